@@ -0,0 +1,241 @@
+import hashlib
+import math
+import os
+import threading
+import time
+from mysql.connector import Error
+from cache import TTLCache
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings (no false negatives)"""
+
+    def __init__(self, capacity=100000, error_rate=0.001):
+        self.capacity = max(capacity, 1)
+        self.error_rate = error_rate
+        self.size = max(8, int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        # Double hashing: k positions from the two halves of one digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class AccountDirectory:
+    """Process-wide account_number -> account map for recipient resolution.
+
+    Loaded once, then refreshed incrementally (accounts with a higher
+    account_id than any seen so far) when a number is not found, at most once
+    per ``refresh_interval`` seconds; a full reload every ``max_age`` seconds
+    picks up status changes made by other processes. Unknown numbers are
+    answered by the Bloom filter without touching the dict or the database.
+    A number still missing after that is looked up by number on the primary
+    (ids can commit out of order, and the replica can lag), and the miss is
+    remembered for ``refresh_interval`` seconds, so an account opened by
+    another worker can read as missing for at most that long.
+
+    Only one thread loads or refreshes at a time; while a full reload runs,
+    other threads keep resolving against the previous map, which is replaced
+    in one assignment when the new one is complete.
+    """
+
+    def __init__(self, db, refresh_interval=1.0, max_age=300, error_rate=0.001):
+        self.db = db
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+        self.error_rate = error_rate
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        # (accounts, bloom), swapped as a pair so lookups never see half of a reload
+        self._index = ({}, BloomFilter(1, error_rate))
+        self._last_account_id = 0
+        self._loaded_at = None
+        self._refreshed_at = 0.0
+        self._hits = 0
+        self._misses = 0
+        self._filtered = 0
+        self._refreshes = 0
+        self._point_lookups = 0
+        self._absent = TTLCache(max_entries=10000, ttl=refresh_interval)
+
+    @classmethod
+    def from_env(cls, db):
+        return cls(
+            db,
+            refresh_interval=float(os.getenv('ACCOUNT_DIRECTORY_REFRESH', 1.0)),
+            max_age=int(os.getenv('ACCOUNT_DIRECTORY_MAX_AGE', 300))
+        )
+
+    def _fetch(self, after_account_id):
+        connection = self.db.get_connection(read_only=True)
+        if not connection:
+            raise Error(msg="No database connection for the account directory")
+        try:
+            cursor = connection.cursor(dictionary=True)
+            cursor.execute("""
+                SELECT a.account_id, a.account_number, a.status, u.full_name
+                FROM accounts a
+                LEFT JOIN users u ON u.user_id = a.user_id
+                WHERE a.account_id > %s
+                ORDER BY a.account_id
+            """, (after_account_id,))
+            rows = cursor.fetchall()
+            cursor.close()
+            return rows
+        finally:
+            connection.close()
+
+    def _fetch_number(self, account_number):
+        connection = self.db.get_connection()
+        if not connection:
+            raise Error(msg="No database connection for the account directory")
+        try:
+            cursor = connection.cursor(dictionary=True)
+            cursor.execute("""
+                SELECT a.account_id, a.account_number, a.status, u.full_name
+                FROM accounts a
+                LEFT JOIN users u ON u.user_id = a.user_id
+                WHERE a.account_number = %s
+            """, (account_number,))
+            row = cursor.fetchone()
+            cursor.close()
+            return row
+        finally:
+            connection.close()
+
+    def _add(self, accounts, bloom, row):
+        """Add a row to ``accounts`` and ``bloom``; returns the bloom, rebuilt if it was full"""
+        number = row['account_number']
+        if number not in accounts:
+            if bloom.count >= bloom.capacity:
+                bloom = self._build_bloom(accounts, 2 * (len(accounts) + 1))
+            bloom.add(number)
+        accounts[number] = {
+            'account_id': row['account_id'],
+            'status': row['status'],
+            'full_name': row['full_name'],
+        }
+        return bloom
+
+    def _build_bloom(self, numbers, capacity):
+        bloom = BloomFilter(capacity, self.error_rate)
+        for number in numbers:
+            bloom.add(number)
+        return bloom
+
+    def load(self):
+        """Full (re)load from the database"""
+        rows = self._fetch(0)
+        accounts = {}
+        bloom = BloomFilter(2 * len(rows) + 1024, self.error_rate)
+        for row in rows:
+            bloom = self._add(accounts, bloom, row)
+        with self._lock:
+            self._index = (accounts, bloom)
+            self._last_account_id = rows[-1]['account_id'] if rows else 0
+            self._loaded_at = self._refreshed_at = time.monotonic()
+            self._refreshes += 1
+
+    def refresh(self):
+        """Pick up accounts created since the last load or refresh"""
+        rows = self._fetch(self._last_account_id)
+        with self._lock:
+            accounts, bloom = self._index
+            for row in rows:
+                bloom = self._add(accounts, bloom, row)
+                self._last_account_id = max(self._last_account_id, row['account_id'])
+            self._index = (accounts, bloom)
+            self._refreshed_at = time.monotonic()
+            self._refreshes += 1
+
+    def _stale(self):
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.max_age
+
+    def _refresh_due(self):
+        return time.monotonic() - self._refreshed_at >= self.refresh_interval
+
+    def _ensure_fresh(self):
+        if not self._stale():
+            return
+        # Before the first load everyone waits for it; afterwards only one
+        # thread reloads and the rest keep using the current map
+        if not self._load_lock.acquire(blocking=self._loaded_at is None):
+            return
+        try:
+            if self._stale():
+                self.load()
+        finally:
+            self._load_lock.release()
+
+    def _lookup(self, account_number):
+        accounts, bloom = self._index
+        if account_number not in bloom:
+            self._filtered += 1
+            return None
+        return accounts.get(account_number)
+
+    def resolve(self, account_number):
+        """Directory entry (account_id, status, full_name) for a number, or None"""
+        self._ensure_fresh()
+        entry = self._lookup(account_number)
+        if entry is None and self._refresh_due():
+            with self._load_lock:
+                if self._refresh_due():
+                    self.refresh()
+            entry = self._lookup(account_number)
+        if entry is None and self._absent.get(account_number) is None:
+            entry = self._point_lookup(account_number)
+        if entry is None:
+            self._misses += 1
+        else:
+            self._hits += 1
+        return entry
+
+    def _point_lookup(self, account_number):
+        self._point_lookups += 1
+        row = self._fetch_number(account_number)
+        if row is None:
+            self._absent.set(account_number, True)
+            return None
+        with self._lock:
+            accounts, bloom = self._index
+            self._index = (accounts, self._add(accounts, bloom, row))
+        return accounts[account_number]
+
+    def account_created(self):
+        """Make the next miss refresh immediately, so new accounts resolve at once"""
+        self._refreshed_at = 0.0
+        self._absent.clear()
+
+    def set_status(self, account_number, status):
+        with self._lock:
+            accounts, _ = self._index
+            entry = accounts.get(account_number)
+            if entry is not None:
+                accounts[account_number] = dict(entry, status=status)
+
+    def stats(self):
+        with self._lock:
+            accounts, bloom = self._index
+            return {
+                'accounts': len(accounts),
+                'hits': self._hits,
+                'misses': self._misses,
+                'bloom_filtered': self._filtered,
+                'refreshes': self._refreshes,
+                'point_lookups': self._point_lookups,
+                'bloom_bits': bloom.size,
+            }
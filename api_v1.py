@@ -0,0 +1,359 @@
+import hashlib
+import io
+import itertools
+import math
+import os
+from datetime import datetime, timedelta
+from decimal import Decimal
+from flask import Blueprint, Response, request, session, jsonify
+from mysql.connector import Error
+from model import decode_page_token
+from serializers import account_json, transaction_json
+from idempotency import IdempotencyConflict, MAX_KEY_LENGTH
+from bulk_payments import BulkPaymentProcessor, PARSERS, credits_only
+
+# Rows accepted in one uploaded bulk payment file
+BULK_UPLOAD_MAX_ROWS = int(os.getenv('BULK_UPLOAD_MAX_ROWS', 10000))
+
+# Transfers accepted in one /transfers:batch request
+BATCH_TRANSFER_MAX_ITEMS = int(os.getenv('BATCH_TRANSFER_MAX_ITEMS', 500))
+
+
+def _error(message, status):
+    return jsonify({'error': message}), status
+
+
+def _etag(*parts):
+    return hashlib.blake2b('|'.join(str(part) for part in parts).encode(), digest_size=12).hexdigest()
+
+
+def _conditional(etag, build):
+    """304 if the client already has ``etag``; otherwise ``build()`` the JSON body.
+
+    ``build`` returns None when the row could not be read, which answers 503.
+    """
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        body = build()
+        if body is None:
+            return _error('Database unavailable', 503)
+        response = jsonify(body)
+    response.set_etag(etag)
+    # Clients may keep the body but must revalidate it on every use
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def _amount(payload):
+    try:
+        amount = float(payload.get('amount'))
+    except (TypeError, ValueError):
+        return None
+    return amount if math.isfinite(amount) and amount > 0 else None
+
+
+def create_api(user_model, account_model, transaction_model, login_limiter, idempotency):
+    """The /api/v1 JSON blueprint, sharing the web app's models and session cookie.
+
+    Account, balance and history responses carry an ETag derived from
+    accounts.version, which moves on every change to the account row. A
+    matching If-None-Match is answered with 304 after one primary-key read,
+    without loading the account from cache or touching the transactions table.
+
+    Money movement accepts an Idempotency-Key header; a retry with the same
+    key and body gets the first result back, marked Idempotent-Replayed.
+    """
+    api = Blueprint('api_v1', __name__, url_prefix='/api/v1')
+
+    @api.before_request
+    def require_login():
+        if request.endpoint != 'api_v1.login' and 'user_id' not in session:
+            return _error('Authentication required', 401)
+
+    @api.route('/session', methods=['POST'], endpoint='login')
+    def login():
+        payload = request.get_json(silent=True) or {}
+        username = payload.get('username') or ''
+        password = payload.get('password') or ''
+        if not isinstance(username, str) or not isinstance(password, str):
+            return _error('username and password must be strings', 400)
+        if not login_limiter.allow(username, request.remote_addr):
+            return _error('Too many login attempts', 429)
+        user = user_model.authenticate_user(username, password)
+        if not user:
+            return _error('Invalid credentials', 401)
+        login_limiter.succeeded(username)
+        session['user_id'] = user['user_id']
+        session['username'] = user['username']
+        session['full_name'] = user['full_name']
+        return jsonify({'user_id': user['user_id'], 'username': user['username'], 'full_name': user['full_name']})
+
+    @api.route('/session', methods=['DELETE'])
+    def logout():
+        session.clear()
+        return '', 204
+
+    def account_version(account_id):
+        versions = account_model.get_versions(session['user_id'], account_id)
+        if versions is None:
+            return None, _error('Database unavailable', 503)
+        if account_id not in versions:
+            return None, _error('Account not found', 404)
+        return versions[account_id], None
+
+    @api.route('/accounts')
+    def accounts():
+        versions = account_model.get_versions(session['user_id'])
+        if versions is None:
+            return _error('Database unavailable', 503)
+        etag = _etag('accounts', session['user_id'], *sorted(versions.items()))
+        return _conditional(etag, lambda: {
+            'accounts': [account_json(a) for a in account_model.get_accounts(session['user_id'], cached=False)]
+        })
+
+    @api.route('/accounts/<int:account_id>')
+    def account(account_id):
+        version, error = account_version(account_id)
+        if error:
+            return error
+        def build():
+            account = account_model.get_owned_account(session['user_id'], account_id, cached=False)
+            return account_json(account) if account else None
+        return _conditional(_etag('account', account_id, version), build)
+
+    @api.route('/accounts/<int:account_id>/balance')
+    def balance(account_id):
+        """Current balance, or with ?as_of=YYYY-MM-DD (end of that day) or a full ISO timestamp, a past one"""
+        version, error = account_version(account_id)
+        if error:
+            return error
+        if request.args.get('as_of'):
+            return balance_as_of(account_id, request.args['as_of'])
+
+        def build():
+            account = account_model.get_owned_account(session['user_id'], account_id, cached=False)
+            if not account:
+                return None
+            return {'account_id': account_id, 'balance': float(account['balance']), 'version': account['version']}
+        return _conditional(_etag('balance', account_id, version), build)
+
+    def balance_as_of(account_id, value):
+        try:
+            as_of = datetime.fromisoformat(value)
+        except ValueError:
+            return _error('as_of must be an ISO date or timestamp', 400)
+        if len(value) == 10:
+            as_of += timedelta(days=1)
+        result = account_model.get_balance_as_of(account_id, as_of)
+        if result is None:
+            return _error('Database unavailable', 503)
+        return jsonify({
+            'account_id': account_id,
+            'as_of': as_of.isoformat(),
+            'balance': float(result['balance']),
+            'snapshot_date': result['snapshot_date'].isoformat() if result['snapshot_date'] else None,
+        })
+
+    @api.route('/accounts/<int:account_id>/transactions')
+    def transactions(account_id):
+        page_token = request.args.get('cursor')
+        if page_token and not decode_page_token(page_token):
+            return _error('Invalid cursor', 400)
+        limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
+        version, error = account_version(account_id)
+        if error:
+            return error
+
+        def build():
+            rows, next_cursor = transaction_model.get_transactions_page(account_id, limit, page_token)
+            return {'transactions': [transaction_json(row) for row in rows], 'next_cursor': next_cursor}
+        return _conditional(_etag('transactions', account_id, version, page_token, limit), build)
+
+    def idempotent(operation, fingerprint=None):
+        """``((applied, result, replayed), None)``, or ``(None, error response)``
+
+        The request is identified by its path and body unless ``fingerprint``
+        is given.
+        """
+        key = request.headers.get('Idempotency-Key', '').strip()
+        if not key:
+            applied, result = operation()
+            return (applied, result, False), None
+        if len(key) > MAX_KEY_LENGTH:
+            return None, _error(f'Idempotency-Key is longer than {MAX_KEY_LENGTH} characters', 400)
+        fingerprint = fingerprint or idempotency.fingerprint(request.path, request.get_data(as_text=True))
+        try:
+            return idempotency.run(session['user_id'], key, fingerprint, operation), None
+        except IdempotencyConflict as e:
+            return None, _error(str(e), 409)
+        except Error as e:
+            print(f"Error claiming idempotency key: {e}")
+            return None, _error('Database unavailable', 503)
+
+    def replay_marked(response, replayed):
+        if replayed:
+            response.headers['Idempotent-Replayed'] = 'true'
+        return response
+
+    def money_movement(account_id, operation):
+        if not account_model.get_owned_account(session['user_id'], account_id):
+            return _error('Account not found', 404)
+        payload = request.get_json(silent=True) or {}
+        amount = _amount(payload)
+        if amount is None:
+            return _error('amount must be a positive number', 400)
+        outcome, error = idempotent(lambda: operation(account_id, amount, payload.get('description') or ''))
+        if error:
+            return error
+        success, message, replayed = outcome
+        if not success:
+            return _error(message, 422)
+        # The money has moved; if the account cannot be re-read, answer without it rather than fail
+        account = account_model.get_owned_account(session['user_id'], account_id, cached=False)
+        body = {'message': message, 'account': account_json(account) if account else None}
+        return replay_marked(jsonify(body), replayed)
+
+    @api.route('/accounts/<int:account_id>/deposit', methods=['POST'])
+    def deposit(account_id):
+        return money_movement(account_id, transaction_model.deposit)
+
+    @api.route('/accounts/<int:account_id>/withdraw', methods=['POST'])
+    def withdraw(account_id):
+        return money_movement(account_id, transaction_model.withdraw)
+
+    @api.route('/transfers', methods=['POST'])
+    def transfer():
+        payload = request.get_json(silent=True) or {}
+        from_account_id = payload.get('from_account_id')
+        to_account_number = str(payload.get('to_account_number') or '').strip()
+        if isinstance(from_account_id, bool) or not isinstance(from_account_id, int):
+            return _error('from_account_id must be an integer', 400)
+        return money_movement(from_account_id, lambda account_id, amount, description: transaction_model.transfer(
+            account_id, to_account_number, amount, description
+        ))
+
+    @api.route('/transfers:batch', methods=['POST'])
+    def transfer_batch():
+        """Many transfers in one database transaction.
+
+        The body is ``{"transfers": [...], "atomic": true}``; each transfer
+        has the fields of POST /transfers. With ``atomic`` (the default)
+        either all are applied or none is, and a failure answers 422.
+        Otherwise each one stands alone. The response lists one result per
+        transfer, in order.
+        """
+        payload = request.get_json(silent=True) or {}
+        items = payload.get('transfers')
+        atomic = payload.get('atomic', True)
+        if not isinstance(items, list) or not items:
+            return _error('transfers must be a non-empty list', 400)
+        if len(items) > BATCH_TRANSFER_MAX_ITEMS:
+            return _error(f'At most {BATCH_TRANSFER_MAX_ITEMS} transfers per batch', 413)
+        if not isinstance(atomic, bool):
+            return _error('atomic must be true or false', 400)
+        # get_versions returns None on a database error, so an outage is not read as "no accounts"
+        owned = account_model.get_versions(session['user_id'])
+        if owned is None:
+            return _error('Database unavailable', 503)
+
+        # Items that fail here never reach the model; the rest are posted together
+        results = [None] * len(items)
+        transfers = []
+        for index, item in enumerate(items):
+            item = item if isinstance(item, dict) else {}
+            from_account_id = item.get('from_account_id')
+            amount = _amount(item)
+            if isinstance(from_account_id, bool) or not isinstance(from_account_id, int) or from_account_id not in owned:
+                results[index] = (False, 'Account not found')
+            elif amount is None:
+                results[index] = (False, 'amount must be a positive number')
+            else:
+                transfers.append({
+                    'from_account_id': from_account_id,
+                    'to_account_number': str(item.get('to_account_number') or '').strip(),
+                    'amount': Decimal(str(amount)),
+                    'description': item.get('description') or '',
+                })
+        if atomic and len(transfers) < len(items):
+            return batch_response([result or (False, 'Batch rolled back') for result in results], atomic)
+
+        def post():
+            posted = iter(transaction_model.transfer_batch(transfers, atomic=atomic))
+            merged = [result or next(posted) for result in results]
+            # Stored for replay only if something was posted
+            return any(success for success, _ in merged), merged
+        outcome, error = idempotent(post)
+        if error:
+            return error
+        _, merged, replayed = outcome
+        return replay_marked(batch_response(merged, atomic), replayed)
+
+    def batch_response(results, atomic):
+        """One result per transfer; 422 if an atomic batch did not go through"""
+        succeeded = sum(1 for success, _ in results if success)
+        body = {
+            'atomic': atomic,
+            'succeeded': succeeded,
+            'failed': len(results) - succeeded,
+            'results': [{'index': index, 'success': success, 'message': message}
+                        for index, (success, message) in enumerate(results)],
+        }
+        response = jsonify(body)
+        response.status_code = 422 if atomic and succeeded < len(results) else 200
+        return response
+
+    # Lookups stay on the request's connection: pool threads would need connections of their own
+    bulk_processor = BulkPaymentProcessor(account_model, transaction_model, workers=1)
+
+    @api.route('/payments:bulk', methods=['POST'])
+    def bulk_payments():
+        """Pay out an uploaded CSV or fixed-width file from one of the user's accounts.
+
+        Answers with the per-row result CSV; rows that were not posted are
+        listed with the reason. Only credits are accepted. A retry with the
+        same Idempotency-Key and file gets the first result CSV back.
+        """
+        upload = request.files.get('file')
+        file_format = request.form.get('format', 'csv')
+        funding_account_id = request.form.get('funding_account_id', type=int)
+        if upload is None:
+            return _error('file is required', 400)
+        if file_format not in PARSERS:
+            return _error(f"format must be one of {', '.join(sorted(PARSERS))}", 400)
+        if funding_account_id is None or not account_model.get_owned_account(session['user_id'], funding_account_id):
+            return _error('Account not found', 404)
+
+        digest = hashlib.blake2b(digest_size=16)
+        for block in iter(lambda: upload.stream.read(65536), b''):
+            digest.update(block)
+        file_digest = digest.hexdigest()
+        upload.stream.seek(0)
+
+        lines = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+        try:
+            # Parsing stops at the first row past the cap, so an oversized upload is never read in full
+            rows = list(itertools.islice(credits_only(PARSERS[file_format](lines)), BULK_UPLOAD_MAX_ROWS + 1))
+        except ValueError as e:
+            return _error(f'Unreadable payment file: {e}', 400)
+        if len(rows) > BULK_UPLOAD_MAX_ROWS:
+            return _error(f'At most {BULK_UPLOAD_MAX_ROWS} payments per file', 413)
+
+        def post():
+            result = io.StringIO()
+            totals = bulk_processor.process(rows, result, funding_account_id=funding_account_id)
+            # Stored for replay only if something was posted
+            return totals['posted'] > 0, {'csv': result.getvalue(), 'posted': totals['posted'],
+                                          'rejected': totals['rejected']}
+        # Multipart bodies carry a random boundary, so identify the upload by its contents
+        outcome, error = idempotent(post, fingerprint=idempotency.fingerprint(
+            request.path, file_format, funding_account_id, file_digest))
+        if error:
+            return error
+        _, result, replayed = outcome
+        response = Response(result['csv'], mimetype='text/csv')
+        response.headers['X-Payments-Posted'] = str(result['posted'])
+        response.headers['X-Payments-Rejected'] = str(result['rejected'])
+        return replay_marked(response, replayed)
+
+    return api
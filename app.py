@@ -1,8 +1,15 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
-from model import Database, User, BankAccount, Transaction
+from flask import Flask, Response, render_template, request, redirect, url_for, session, flash, jsonify, stream_with_context
+from model import Database, User, BankAccount, Transaction, decode_page_token
 from mysql.connector import Error
+from rate_limiter import LoginRateLimiter
+from api_v1 import create_api
+from serializers import transaction_json
+from statements import csv_chunks, jsonl_chunks
+from idempotency import IdempotencyStore, IdempotencyConflict, MAX_KEY_LENGTH
+from datetime import date, datetime, timedelta
 import os
 import sys
+import uuid
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key_here'
@@ -12,6 +19,17 @@ db = Database()
 user_model = User(db)
 account_model = BankAccount(db)
 transaction_model = Transaction(db)
+login_limiter = LoginRateLimiter.from_env()
+idempotency = IdempotencyStore.from_env(db)
+
+# All model calls in a request share one pooled connection, released here
+app.teardown_appcontext(db.release_request_connection)
+
+# JSON API for mobile and partner clients
+app.register_blueprint(create_api(user_model, account_model, transaction_model, login_limiter, idempotency))
+
+# Each rendered money form carries a fresh key, so a resubmitted form posts once
+app.jinja_env.globals['new_idempotency_key'] = lambda: uuid.uuid4().hex
 
 @app.route('/')
 def index():
@@ -43,8 +61,14 @@ def login():
         username = request.form['username']
         password = request.form['password']
         
+        # Rejected before any database or hashing work
+        if not login_limiter.allow(username, request.remote_addr):
+            flash('Too many login attempts. Please try again in a few minutes.', 'error')
+            return render_template('login.html'), 429
+        
         user = user_model.authenticate_user(username, password)
         if user:
+            login_limiter.succeeded(username)
             session['user_id'] = user['user_id']
             session['username'] = user['username']
             session['full_name'] = user['full_name']
@@ -77,10 +101,13 @@ def deposit():
         return redirect(url_for('login'))
     
     account_id = request.form['account_id']
+    if not _owned_account(account_id):
+        flash('Account not found or access denied.', 'error')
+        return redirect(url_for('accounts'))
     amount = float(request.form['amount'])
     description = request.form.get('description', '')
     
-    success, message = transaction_model.deposit(account_id, amount, description)
+    success, message = _idempotent(lambda: transaction_model.deposit(account_id, amount, description))
     if success:
         flash('Deposit successful!', 'success')
     else:
@@ -95,11 +122,14 @@ def transfer():
     
     if request.method == 'POST':
         from_account_id = request.form['from_account_id']
-        to_account_number = request.form['to_account_number']
+        if not _owned_account(from_account_id):
+            flash('Account not found or access denied.', 'error')
+            return redirect(url_for('accounts'))
+        to_account_number = request.form['to_account_number'].strip()
         amount = float(request.form['amount'])
         description = request.form.get('description', '')
         
-        success, message = transaction_model.transfer(from_account_id, to_account_number, amount, description)
+        success, message = _idempotent(lambda: transaction_model.transfer(from_account_id, to_account_number, amount, description))
         if success:
             flash('Transfer successful!', 'success')
         else:
@@ -116,10 +146,13 @@ def withdraw():
         return redirect(url_for('login'))
     
     account_id = request.form['account_id']
+    if not _owned_account(account_id):
+        flash('Account not found or access denied.', 'error')
+        return redirect(url_for('accounts'))
     amount = float(request.form['amount'])
     description = request.form.get('description', '')
     
-    success, message = transaction_model.withdraw(account_id, amount, description)
+    success, message = _idempotent(lambda: transaction_model.withdraw(account_id, amount, description))
     if success:
         flash('Withdrawal successful!', 'success')
     else:
@@ -143,37 +176,121 @@ def create_account():
         else:
             flash('Account creation failed. Please try again.', 'error')
     
-    # Get branches for the form
-    connection = db.get_connection()
-    branches = []
-    if connection:
-        try:
-            cursor = connection.cursor(dictionary=True)
-            cursor.execute("SELECT * FROM branches")
-            branches = cursor.fetchall()
-        except Error as e:
-            print(f"Error fetching branches: {e}")
-        finally:
-            cursor.close()
-            connection.close()
+    # Branches come from the reference-data cache, not a query per request
+    try:
+        branches = db.reference_data.branches()
+    except Error as e:
+        print(f"Error fetching branches: {e}")
+        branches = []
     
     return render_template('create_account.html', branches=branches)
 
+def _owned_account(account_id):
+    """The session user's account with this id, or None"""
+    try:
+        account_id = int(account_id)
+    except (TypeError, ValueError):
+        return None
+    return account_model.get_owned_account(session['user_id'], account_id)
+
+def _idempotent(operation):
+    """Run a money movement once per Idempotency-Key header or idempotency_key form field.
+
+    Without a key the operation just runs. A retry with the same key gets
+    the first result back instead of posting again.
+    """
+    key = (request.headers.get('Idempotency-Key') or request.form.get('idempotency_key') or '').strip()
+    if not key:
+        return operation()
+    if len(key) > MAX_KEY_LENGTH:
+        return False, "Idempotency key is too long"
+    fields = sorted((name, value) for name, value in request.form.items(multi=True) if name != 'idempotency_key')
+    try:
+        success, message, _ = idempotency.run(session['user_id'], key, idempotency.fingerprint(request.path, fields),
+                                              operation)
+    except IdempotencyConflict as e:
+        return False, str(e)
+    except Error as e:
+        print(f"Error claiming idempotency key: {e}")
+        return False, "Database unavailable"
+    return success, message
+
 @app.route('/transactions/<int:account_id>')
 def transactions(account_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
     # Verify account belongs to user
-    accounts = account_model.get_accounts(session['user_id'])
-    account = next((acc for acc in accounts if acc['account_id'] == account_id), None)
+    account = _owned_account(account_id)
+    
+    if not account:
+        flash('Account not found or access denied.', 'error')
+        return redirect(url_for('accounts'))
+    
+    page_token = request.args.get('cursor')
+    if page_token and not decode_page_token(page_token):
+        flash('Invalid page link.', 'error')
+        return redirect(url_for('transactions', account_id=account_id))
+    
+    transactions, next_cursor = transaction_model.get_transactions_page(account_id, page_token=page_token)
+    return render_template('transactions.html', account=account, transactions=transactions,
+                           next_cursor=next_cursor, paged=bool(page_token))
+
+@app.route('/transactions/<int:account_id>/more')
+def more_transactions(account_id):
+    """JSON "load more" endpoint: ?cursor=<token from the previous page>&limit=N"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Authentication required'}), 401
+    
+    if not _owned_account(account_id):
+        return jsonify({'error': 'Account not found'}), 404
     
+    page_token = request.args.get('cursor')
+    if page_token and not decode_page_token(page_token):
+        return jsonify({'error': 'Invalid cursor'}), 400
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
+    
+    transactions, next_cursor = transaction_model.get_transactions_page(account_id, limit, page_token)
+    return jsonify({
+        'transactions': [transaction_json(transaction) for transaction in transactions],
+        'next_cursor': next_cursor,
+    })
+
+STATEMENT_FORMATS = {
+    'csv': (csv_chunks, 'text/csv'),
+    'jsonl': (jsonl_chunks, 'application/x-ndjson'),
+}
+
+@app.route('/accounts/<int:account_id>/statement.<fmt>')
+def statement(account_id, fmt):
+    """Download history between ?from= and ?to= (YYYY-MM-DD, inclusive; default the last 30 days)"""
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    if fmt not in STATEMENT_FORMATS:
+        return 'Unknown statement format', 404
+    
+    account = _owned_account(account_id)
     if not account:
         flash('Account not found or access denied.', 'error')
         return redirect(url_for('accounts'))
     
-    transactions = transaction_model.get_transactions(account_id)
-    return render_template('transactions.html', account=account, transactions=transactions)
+    try:
+        end = date.fromisoformat(request.args['to']) if request.args.get('to') else date.today()
+        start = date.fromisoformat(request.args['from']) if request.args.get('from') else end - timedelta(days=30)
+    except ValueError:
+        flash('Invalid statement dates; use YYYY-MM-DD.', 'error')
+        return redirect(url_for('transactions', account_id=account_id))
+    if start > end:
+        flash('Statement start date is after its end date.', 'error')
+        return redirect(url_for('transactions', account_id=account_id))
+    
+    # Rows go straight from an unbuffered cursor to the client, a chunk at a time
+    encode, mimetype = STATEMENT_FORMATS[fmt]
+    rows = transaction_model.iter_statement(account_id, datetime.combine(start, datetime.min.time()),
+                                            datetime.combine(end + timedelta(days=1), datetime.min.time()))
+    filename = f"statement-{account['account_number'][-4:]}-{start}-{end}.{fmt}"
+    return Response(stream_with_context(encode(rows)), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
 
 @app.route('/logout')
 def logout():
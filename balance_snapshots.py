@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+End-of-day balance snapshots for as-of-date balance queries.
+
+    python balance_snapshots.py                       # every day not yet snapshotted, up to yesterday
+    python balance_snapshots.py --from 2026-01-01 --to 2026-01-31
+
+For each day, only that day's transactions are read (idx_transactions_date):
+every account with activity gets a row in account_daily_balances holding its
+closing balance, i.e. its previous snapshot plus the day's net movement.
+An account without an earlier snapshot starts from its replayed history.
+Accounts without activity get no row; their last snapshot still holds. A day
+is recomputed from scratch when it is run again, so days must be run in
+order, and re-running a past day means re-running the days after it too;
+--from may not start after the day following the last run.
+
+BankAccount.get_balance_as_of combines the latest snapshot with the
+transactions since, so its cost does not depend on the length of the history.
+"""
+
+import argparse
+import os
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from mysql.connector import Error
+from model import Database
+
+
+def day_bounds(day):
+    start = datetime.combine(day, datetime.min.time())
+    return start, start + timedelta(days=1)
+
+
+class BalanceSnapshotJob:
+    def __init__(self, db, chunk_size=1000):
+        self.db = db
+        self.chunk_size = chunk_size
+
+    def last_run_day(self):
+        connection = self.db.checkout()
+        if not connection:
+            raise Error(msg="Database unavailable")
+        try:
+            cursor = connection.cursor(dictionary=True)
+            cursor.execute("SELECT MAX(balance_date) AS last_day FROM account_daily_balance_runs")
+            last_day = cursor.fetchone()['last_day']
+            cursor.close()
+        finally:
+            connection.close()
+        return _as_date(last_day) if last_day is not None else None
+
+    def check_start(self, start):
+        """Raise ValueError if starting at ``start`` would skip days after the last run"""
+        last_day = self.last_run_day()
+        if last_day is not None and start > last_day + timedelta(days=1):
+            raise ValueError(f"{start} would leave {last_day + timedelta(days=1)} to {start - timedelta(days=1)} "
+                             f"without snapshots; start at or before {last_day + timedelta(days=1)}")
+
+    def pending_days(self, until):
+        """Days after the last completed run (or from the first transaction) up to ``until``"""
+        last_day = self.last_run_day()
+        if last_day is not None:
+            first = last_day + timedelta(days=1)
+        else:
+            connection = self.db.checkout()
+            if not connection:
+                raise Error(msg="Database unavailable")
+            try:
+                cursor = connection.cursor(dictionary=True)
+                cursor.execute("SELECT MIN(transaction_date) AS first_at FROM transactions")
+                first_at = cursor.fetchone()['first_at']
+                cursor.close()
+            finally:
+                connection.close()
+            if first_at is None:
+                return []
+            first = _as_datetime(first_at).date()
+        return [first + timedelta(days=n) for n in range((until - first).days + 1)]
+
+    def run_day(self, day):
+        """Snapshot closing balances for ``day``; returns how many accounts moved"""
+        start, end = day_bounds(day)
+        connection = self.db.checkout()
+        if not connection:
+            raise Error(msg="Database unavailable")
+        try:
+            cursor = connection.cursor(dictionary=True)
+            cursor.execute("""
+                SELECT account_id, SUM(delta) AS delta FROM (
+                    SELECT to_account_id AS account_id, amount AS delta FROM transactions
+                    WHERE transaction_date >= %s AND transaction_date < %s AND to_account_id IS NOT NULL
+                    UNION ALL
+                    SELECT from_account_id AS account_id, -amount AS delta FROM transactions
+                    WHERE transaction_date >= %s AND transaction_date < %s AND from_account_id IS NOT NULL
+                ) AS movements
+                GROUP BY account_id
+            """, (start, end, start, end))
+            deltas = {row['account_id']: Decimal(str(row['delta'])) for row in cursor.fetchall()}
+
+            # A re-run replaces the day in the same transaction
+            cursor.execute("DELETE FROM account_daily_balances WHERE balance_date = %s", (day,))
+            account_ids = sorted(deltas)
+            for offset in range(0, len(account_ids), self.chunk_size):
+                chunk = account_ids[offset:offset + self.chunk_size]
+                previous = self._previous_closing(cursor, chunk, day)
+                unseeded = [account_id for account_id in chunk if account_id not in previous]
+                if unseeded:
+                    previous.update(self._replayed_opening(cursor, unseeded, start))
+                cursor.executemany("""
+                    INSERT INTO account_daily_balances (account_id, balance_date, closing_balance)
+                    VALUES (%s, %s, %s)
+                """, [(account_id, day, previous.get(account_id, Decimal('0')) + deltas[account_id])
+                      for account_id in chunk])
+
+            cursor.execute("DELETE FROM account_daily_balance_runs WHERE balance_date = %s", (day,))
+            cursor.execute("INSERT INTO account_daily_balance_runs (balance_date, accounts) VALUES (%s, %s)",
+                           (day, len(account_ids)))
+            connection.commit()
+            cursor.close()
+            return len(account_ids)
+        except Error:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+
+    def _previous_closing(self, cursor, account_ids, day):
+        placeholders = ', '.join(['%s'] * len(account_ids))
+        cursor.execute(f"""
+            SELECT s.account_id, s.closing_balance
+            FROM account_daily_balances s
+            JOIN (
+                SELECT account_id, MAX(balance_date) AS balance_date
+                FROM account_daily_balances
+                WHERE account_id IN ({placeholders}) AND balance_date < %s
+                GROUP BY account_id
+            ) latest ON latest.account_id = s.account_id AND latest.balance_date = s.balance_date
+        """, list(account_ids) + [day])
+        return {row['account_id']: Decimal(str(row['closing_balance'])) for row in cursor.fetchall()}
+
+    def _replayed_opening(self, cursor, account_ids, start):
+        """Balance before ``start`` from the transactions themselves, for accounts without a snapshot"""
+        placeholders = ', '.join(['%s'] * len(account_ids))
+        cursor.execute(f"""
+            SELECT account_id, SUM(delta) AS delta FROM (
+                SELECT to_account_id AS account_id, amount AS delta FROM transactions
+                WHERE to_account_id IN ({placeholders}) AND transaction_date < %s
+                UNION ALL
+                SELECT from_account_id AS account_id, -amount AS delta FROM transactions
+                WHERE from_account_id IN ({placeholders}) AND transaction_date < %s
+            ) AS movements
+            GROUP BY account_id
+        """, list(account_ids) + [start] + list(account_ids) + [start])
+        return {row['account_id']: Decimal(str(row['delta'])) for row in cursor.fetchall()}
+
+    def run(self, days):
+        for day in days:
+            started = time.monotonic()
+            accounts = self.run_day(day)
+            print(f"Snapshot {day}: {accounts} account(s) in {time.monotonic() - started:.2f}s")
+
+
+def _as_date(value):
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _as_datetime(value):
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build end-of-day balance snapshots')
+    parser.add_argument('--from', dest='start', type=date.fromisoformat,
+                        help='first day (default: the day after the last run)')
+    parser.add_argument('--to', dest='end', type=date.fromisoformat,
+                        default=date.today() - timedelta(days=1), help='last day (default yesterday)')
+    parser.add_argument('--chunk-size', type=int, default=int(os.getenv('SNAPSHOT_CHUNK_SIZE', 1000)))
+    args = parser.parse_args()
+
+    job = BalanceSnapshotJob(Database(), chunk_size=args.chunk_size)
+    if args.start:
+        try:
+            job.check_start(args.start)
+        except ValueError as e:
+            parser.error(str(e))
+        days = [args.start + timedelta(days=n) for n in range((args.end - args.start).days + 1)]
+    else:
+        days = job.pending_days(args.end)
+    job.run(days)
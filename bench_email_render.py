@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Benchmark for rendering transaction notification emails (no network).
+
+    python bench_email_render.py [iterations]
+
+Reports the per-message cost of EmailService.build_transaction_message,
+which formats the fields and renders the pre-rendered HTML and text parts.
+"""
+
+import sys
+import time
+from email_service import EmailService
+
+def bench_email_render(iterations=20000):
+    email_service = EmailService()
+    cases = [
+        ('deposit', 'Salary for March'),
+        ('withdrawal', ''),
+        ('transfer', 'Rent <June> & utilities'),
+    ]
+    
+    print(f"Rendering {iterations} messages per transaction type...")
+    for transaction_type, description in cases:
+        started = time.perf_counter()
+        for i in range(iterations):
+            email_service.build_transaction_message(
+                user_email='test@example.com',
+                user_name='Test User',
+                transaction_type=transaction_type,
+                amount=1234.5 + i,
+                account_number='123456789012',
+                balance=98765.43,
+                description=description
+            )
+        elapsed = time.perf_counter() - started
+        print(f"{transaction_type:<11} {elapsed / iterations * 1e6:8.2f} µs/message  "
+              f"({iterations / elapsed:,.0f} messages/s)")
+
+if __name__ == "__main__":
+    bench_email_render(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Bulk payment files (payroll credits, bulk debits).
+
+    python bulk_payments.py payroll.csv results.csv
+    python bulk_payments.py --format fixed --funding-account 42 payroll.txt results.csv
+
+CSV files have a header row with account_number and amount columns, and
+optionally type (credit/debit, default credit) and description.
+
+Fixed-width files have one payment per line:
+
+    columns  1-20  account number, left-aligned
+    column     21  C (credit) or D (debit)
+    columns 22-36  amount in cents, zero-padded
+    columns 37-96  description
+
+The file is parsed as a stream (memory-mapped when read from disk) in chunks
+of --chunk-size rows. Each chunk's recipients are checked against the accounts
+table with parallel IN (...) lookups, then posted with
+Transaction.post_entries: one transaction per chunk, a set-based balance
+update and executemany inserts. Every input row gets a line in the result
+file with its status.
+
+With a funding account, credits are transfers out of it and debits are
+transfers into it; without one, they are deposits and withdrawals.
+"""
+
+import argparse
+import csv
+import mmap
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+from mysql.connector import Error
+from account_numbers import is_valid_account_number
+
+RESULT_FIELDS = ['line', 'account_number', 'type', 'amount', 'status', 'message']
+
+FIXED_WIDTH_LAYOUT = {
+    'account_number': (0, 20),
+    'type': (20, 21),
+    'amount_cents': (21, 36),
+    'description': (36, 96),
+}
+
+TYPE_CODES = {'c': 'credit', 'credit': 'credit', 'd': 'debit', 'debit': 'debit'}
+
+
+class PaymentRow:
+    __slots__ = ('line', 'account_number', 'type', 'amount', 'description', 'error')
+
+    def __init__(self, line, account_number, type_, amount, description, error=None):
+        self.line = line
+        self.account_number = account_number
+        self.type = type_
+        self.amount = amount
+        self.description = description
+        self.error = error
+
+
+def _parse_amount(text, cents=False):
+    try:
+        amount = Decimal(text.strip())
+    except InvalidOperation:
+        return None
+    if cents:
+        amount /= 100
+    if not amount.is_finite() or amount <= 0 or amount != amount.quantize(Decimal('0.01')):
+        return None
+    return amount.quantize(Decimal('0.01'))
+
+
+def _row(line, account_number, type_text, amount, description):
+    account_number = account_number.strip()
+    type_ = TYPE_CODES.get(type_text.strip().lower())
+    description = description.strip()
+    if type_ is None:
+        return PaymentRow(line, account_number, type_text.strip(), amount, description, "Unknown payment type")
+    if amount is None:
+        return PaymentRow(line, account_number, type_, amount, description, "Invalid amount")
+    if not is_valid_account_number(account_number):
+        return PaymentRow(line, account_number, type_, amount, description, "Invalid account number")
+    return PaymentRow(line, account_number, type_, amount, description)
+
+
+def parse_csv(lines):
+    """PaymentRows from an iterable of text lines with a header row"""
+    reader = csv.DictReader(lines)
+    missing = {'account_number', 'amount'} - set(reader.fieldnames or ())
+    if missing:
+        raise ValueError(f"CSV header is missing {', '.join(sorted(missing))}")
+    for record in reader:
+        yield _row(reader.line_num, record['account_number'] or '', record.get('type') or 'credit',
+                   _parse_amount(record['amount'] or ''), record.get('description') or '')
+
+
+def parse_fixed_width(lines):
+    """PaymentRows from an iterable of fixed-width text lines"""
+    for line_no, line in enumerate(lines, 1):
+        line = line.rstrip('\r\n')
+        if not line.strip():
+            continue
+        field = {name: line[start:end] for name, (start, end) in FIXED_WIDTH_LAYOUT.items()}
+        yield _row(line_no, field['account_number'], field['type'],
+                   _parse_amount(field['amount_cents'], cents=True), field['description'])
+
+
+PARSERS = {'csv': parse_csv, 'fixed': parse_fixed_width}
+
+
+def credits_only(rows):
+    """Reject debit rows, for files whose submitter may only pay out"""
+    for row in rows:
+        if row.error is None and row.type == 'debit':
+            row.error = "Debits are not allowed"
+        yield row
+
+
+def mapped_lines(path):
+    """Decoded lines of a file read through mmap, without loading it whole"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for line in iter(mapped.readline, b''):
+                yield line.decode('utf-8-sig' if mapped.tell() == len(line) else 'utf-8')
+
+
+class BulkPaymentProcessor:
+    def __init__(self, account_model, transaction_model, chunk_size=2000, lookup_batch=500, workers=4, notify=True):
+        self.account_model = account_model
+        self.transaction_model = transaction_model
+        self.chunk_size = chunk_size
+        self.lookup_batch = lookup_batch
+        self.workers = workers
+        self.notify = notify
+        self._executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+
+    def _resolve(self, numbers):
+        """Look recipients up in lookup_batch-sized IN queries, in parallel when workers > 1"""
+        numbers = list(set(numbers))
+        batches = [numbers[start:start + self.lookup_batch] for start in range(0, len(numbers), self.lookup_batch)]
+        mapper = self._executor.map if self._executor else map
+        accounts = {}
+        for found in mapper(self.account_model.resolve_account_numbers, batches):
+            accounts.update(found)
+        return accounts
+
+    def _entry(self, row, account_id, funding_account_id):
+        description = row.description or ('Bulk credit' if row.type == 'credit' else 'Bulk debit')
+        if funding_account_id is not None:
+            debit, credit = (funding_account_id, account_id) if row.type == 'credit' else (account_id, funding_account_id)
+            transaction_type = 'transfer'
+        elif row.type == 'credit':
+            debit, credit, transaction_type = None, account_id, 'deposit'
+        else:
+            debit, credit, transaction_type = account_id, None, 'withdrawal'
+        return {'debit': debit, 'credit': credit, 'amount': row.amount,
+                'transaction_type': transaction_type, 'description': description}
+
+    def process_chunk(self, rows, funding_account_id=None):
+        """Post one chunk; returns (row, status, message) per row"""
+        results = {}
+        valid = [row for row in rows if row.error is None]
+        try:
+            accounts = self._resolve(row.account_number for row in valid)
+        except Error as e:
+            print(f"Error resolving bulk payment accounts: {e}")
+            return [(row, 'rejected', row.error or "Database unavailable") for row in rows]
+
+        postable = []
+        for row in valid:
+            account = accounts.get(row.account_number)
+            if account is None:
+                row.error = "Account not found"
+            elif account['status'] != 'active':
+                row.error = f"Account is {account['status']}"
+            elif account['account_id'] == funding_account_id:
+                row.error = "Account is the funding account"
+            else:
+                postable.append((row, self._entry(row, account['account_id'], funding_account_id)))
+
+        if postable:
+            outcomes = self.transaction_model.post_entries([entry for _, entry in postable], notify=self.notify,
+                                                           label='bulk payment')
+            for (row, _), (success, message) in zip(postable, outcomes):
+                results[row.line] = ('posted', message) if success else ('rejected', message)
+        return [(row, *results.get(row.line, ('rejected', row.error))) for row in rows]
+
+    def process(self, rows, result_file, funding_account_id=None):
+        """Post a stream of PaymentRows chunk by chunk, writing one result line per row; returns totals"""
+        started = time.monotonic()
+        writer = csv.writer(result_file)
+        writer.writerow(RESULT_FIELDS)
+        totals = {'rows': 0, 'posted': 0, 'rejected': 0, 'posted_amount': Decimal('0')}
+        chunk = []
+
+        def flush():
+            for row, status, message in self.process_chunk(chunk, funding_account_id):
+                writer.writerow([row.line, row.account_number, row.type, row.amount, status, message])
+                totals['rows'] += 1
+                totals[status] += 1
+                if status == 'posted':
+                    totals['posted_amount'] += row.amount
+            chunk.clear()
+
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= self.chunk_size:
+                flush()
+        if chunk:
+            flush()
+        seconds = time.monotonic() - started
+        totals['seconds'] = round(seconds, 3)
+        totals['rows_per_second'] = round(totals['rows'] / seconds) if seconds else totals['rows']
+        return totals
+
+
+if __name__ == '__main__':
+    from model import Database, BankAccount, Transaction
+
+    parser = argparse.ArgumentParser(description='Post a bulk payment file')
+    parser.add_argument('input', help='payment file')
+    parser.add_argument('output', help='result file (CSV, one line per payment)')
+    parser.add_argument('--format', choices=sorted(PARSERS), default='csv')
+    parser.add_argument('--funding-account', type=int, help='account_id that funds credits and receives debits')
+    parser.add_argument('--chunk-size', type=int, default=int(os.getenv('BULK_CHUNK_SIZE', 2000)))
+    parser.add_argument('--workers', type=int, default=int(os.getenv('BULK_VALIDATION_WORKERS', 4)),
+                        help='parallel recipient lookups')
+    parser.add_argument('--no-notify', action='store_true', help='do not queue notification emails')
+    args = parser.parse_args()
+
+    db = Database()
+    processor = BulkPaymentProcessor(BankAccount(db), Transaction(db), chunk_size=args.chunk_size,
+                                     workers=args.workers, notify=not args.no_notify)
+    with open(args.output, 'w', newline='') as result_file:
+        totals = processor.process(PARSERS[args.format](mapped_lines(args.input)), result_file,
+                                   funding_account_id=args.funding_account)
+    print(f"Processed {totals['rows']} payment(s): {totals['posted']} posted, {totals['rejected']} rejected, "
+          f"{totals['posted_amount']} total, {totals['rows_per_second']}/s")
@@ -0,0 +1,124 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after ``ttl`` seconds.
+
+    Entries can carry tags, so a write can drop every entry that depends on a
+    row (``invalidate_tag(('account', 42))``) without knowing their keys.
+    Memory is bounded by ``max_entries``; the least recently used entry is
+    evicted first. The cache is per process: other workers only see a change
+    once their own entry expires.
+
+    A value read from the database can be older than an invalidation that
+    ran while it was being read. Callers take ``generation()`` before the
+    read and pass it to ``set``, which then skips the store if anything was
+    invalidated in between.
+    """
+
+    def __init__(self, max_entries=10000, ttl=30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+        self._generation = 0
+        self._stale_sets = 0
+
+    @classmethod
+    def from_env(cls, prefix, max_entries=10000, ttl=30.0):
+        """Cache sized by ``<prefix>_MAX_ENTRIES`` and ``<prefix>_TTL``"""
+        return cls(
+            max_entries=int(os.getenv(f'{prefix}_MAX_ENTRIES', max_entries)),
+            ttl=float(os.getenv(f'{prefix}_TTL', ttl))
+        )
+
+    def _drop(self, key):
+        # Caller holds the lock
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return default
+            if entry[0] <= time.monotonic():
+                self._drop(key)
+                self._expirations += 1
+                self._misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[1]
+
+    def generation(self):
+        """Counter that moves on every invalidation; see ``set``"""
+        return self._generation
+
+    def set(self, key, value, tags=(), ttl=None, generation=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                self._stale_sets += 1
+                return
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (expires_at, value, tuple(tags))
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self._evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            if key in self._entries:
+                self._drop(key)
+                self._invalidations += 1
+
+    def invalidate_tag(self, tag):
+        with self._lock:
+            self._generation += 1
+            for key in list(self._tags.get(tag, ())):
+                self._drop(key)
+                self._invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._tags.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 4) if lookups else 0.0,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+                'invalidations': self._invalidations,
+                'stale_sets': self._stale_sets,
+            }
@@ -0,0 +1,153 @@
+import threading
+import time
+from mysql.connector import Error
+from mysql.connector.errors import PoolError
+from mysql.connector.pooling import MySQLConnectionPool, CNX_POOL_MAXSIZE
+
+
+class PooledConnection:
+    """Connection borrowed from a ConnectionPool; close() hands it back"""
+
+    def __init__(self, pool, pooled_cnx):
+        self._pool = pool
+        self._pooled_cnx = pooled_cnx
+
+    def __getattr__(self, attr):
+        return getattr(self._pooled_cnx, attr)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._pooled_cnx is None:
+            return
+        pooled_cnx, self._pooled_cnx = self._pooled_cnx, None
+        self._pool._release(pooled_cnx)
+
+    def discard(self):
+        """Hand the connection back disconnected, e.g. when unread rows are left on it.
+
+        The pool reconnects it on its next checkout.
+        """
+        if self._pooled_cnx is None:
+            return
+        cnx = self._pooled_cnx._cnx
+        cnx.shutdown()
+        cnx.unread_result = False
+        try:
+            self.close()
+        except Error:
+            # Resetting the session of a closed connection fails, but it is back in the pool
+            pass
+
+
+class ConnectionPool:
+    """Bounded MySQL connection pool built on mysql.connector.pooling.
+
+    MySQLConnectionPool fails immediately when it is exhausted, so checkouts
+    are gated by a semaphore that lets callers wait up to ``timeout`` seconds
+    for a connection. The connector pings every connection it hands out (and
+    reconnects it if the ping fails); on top of that, connections older than
+    ``max_lifetime`` seconds are recycled on checkout.
+    """
+
+    def __init__(self, pool_size=5, timeout=10.0, max_lifetime=1800, pool_name='banking_pool',
+                 reset_session=True, **connect_args):
+        if not 1 <= pool_size <= CNX_POOL_MAXSIZE:
+            raise ValueError(f"pool_size must be between 1 and {CNX_POOL_MAXSIZE}")
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._lock = threading.Lock()
+        self._born = {}
+        self._in_use = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._timeouts = 0
+        self._recycled = 0
+        self._errors = 0
+        # The connector opens every connection of the pool up front
+        self._pool = MySQLConnectionPool(
+            pool_name=pool_name,
+            pool_size=pool_size,
+            pool_reset_session=reset_session,
+            **connect_args
+        )
+        now = time.monotonic()
+        for cnx in list(self._pool._cnx_queue.queue):
+            self._born[id(cnx)] = now
+
+    def get_connection(self, timeout=None):
+        """Borrow a connection, waiting up to ``timeout`` seconds for a free one"""
+        timeout = self.timeout if timeout is None else timeout
+        if not self._slots.acquire(blocking=False):
+            started = time.monotonic()
+            acquired = self._slots.acquire(timeout=timeout)
+            waited = time.monotonic() - started
+            with self._lock:
+                self._waits += 1
+                self._wait_time += waited
+                if not acquired:
+                    self._timeouts += 1
+            if not acquired:
+                raise PoolError(f"Timed out after {timeout}s waiting for a database connection")
+
+        try:
+            pooled_cnx = self._pool.get_connection()
+            self._recycle_if_expired(pooled_cnx)
+        except Error:
+            with self._lock:
+                self._errors += 1
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+        return PooledConnection(self, pooled_cnx)
+
+    def _recycle_if_expired(self, pooled_cnx):
+        cnx = pooled_cnx._cnx
+        now = time.monotonic()
+        born = self._born.setdefault(id(cnx), now)
+        if self.max_lifetime and now - born > self.max_lifetime:
+            try:
+                cnx.reconnect()
+            except Error:
+                # Hand the broken connection back; the next checkout reconnects it
+                try:
+                    pooled_cnx.close()
+                except Error:
+                    pass
+                raise
+            self._born[id(cnx)] = time.monotonic()
+            with self._lock:
+                self._recycled += 1
+
+    def _release(self, pooled_cnx):
+        try:
+            pooled_cnx.close()
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    def stats(self):
+        """Snapshot of pool usage counters"""
+        with self._lock:
+            return {
+                'size': self.pool_size,
+                'in_use': self._in_use,
+                'idle': self.pool_size - self._in_use,
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'wait_time': round(self._wait_time, 6),
+                'timeouts': self._timeouts,
+                'recycled': self._recycled,
+                'errors': self._errors,
+            }
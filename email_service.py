@@ -1,6 +1,118 @@
 import requests
 import os
+import re
 from datetime import datetime
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from markupsafe import Markup, escape
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+# Per-type styling and wording for templates/email/transaction.{html,txt}
+EMAIL_THEMES = {
+    'deposit': {
+        'subject': 'Deposit Confirmation',
+        'title': '💰 Deposit Confirmation',
+        'gradient': '#667eea 0%, #764ba2 100%',
+        'accent': '#28a745',
+        'heading': '✅ Deposit Successful',
+        'amount_color': '#28a745',
+        'amount_sign': '',
+        'account_label': 'Account',
+        'noun': 'deposit',
+        'action': 'has been made to',
+    },
+    'withdrawal': {
+        'subject': 'Withdrawal Notification',
+        'title': '💳 Withdrawal Notification',
+        'gradient': '#ff6b6b 0%, #ee5a24 100%',
+        'accent': '#ffc107',
+        'heading': '⚠️ Withdrawal Processed',
+        'amount_color': '#dc3545',
+        'amount_sign': '-',
+        'account_label': 'Account',
+        'noun': 'withdrawal',
+        'action': 'has been made from',
+    },
+    'transfer': {
+        'subject': 'Transfer Notification',
+        'title': '🔄 Transfer Notification',
+        'gradient': '#667eea 0%, #764ba2 100%',
+        'accent': '#17a2b8',
+        'heading': '📤 Transfer Processed',
+        'amount_color': '#dc3545',
+        'amount_sign': '-',
+        'account_label': 'From Account',
+        'noun': 'transfer',
+        'action': 'has been processed from',
+    },
+}
+
+EMAIL_FIELDS = ('user_name', 'amount', 'account_number', 'balance', 'description', 'processed_at')
+
+class PrerenderedTemplate:
+    """A Jinja template rendered once with its static context.
+    
+    Each message field is rendered as a marker, and the output is split on
+    the markers into static chunks. Rendering a message then only escapes
+    the field values and joins them with the chunks.
+    """
+    
+    MARKER = re.compile('\x00(\\w+)\x00')
+    
+    def __init__(self, template, static_context, fields, escape_fields):
+        markers = {field: Markup(f'\x00{field}\x00') for field in fields}
+        parts = self.MARKER.split(template.render(static_context, **markers))
+        # parts alternates static text and field names: [text, field, text, ...]
+        self.chunks = parts[0::2]
+        self.fields = parts[1::2]
+        self.escape = escape if escape_fields else str
+    
+    def render(self, values):
+        out = [self.chunks[0]]
+        for field, chunk in zip(self.fields, self.chunks[1:]):
+            out.append(self.escape(values[field]))
+            out.append(chunk)
+        return ''.join(out)
+
+# Compiled and pre-rendered once at import; the HTML part has a variant with
+# and without the optional description row
+_environment = Environment(
+    loader=FileSystemLoader(TEMPLATE_DIR),
+    autoescape=select_autoescape(['html'])
+)
+HTML_TEMPLATES = {
+    (transaction_type, has_description): PrerenderedTemplate(
+        _environment.get_template('email/transaction.html'),
+        {'theme': theme, 'description': has_description},
+        [field for field in EMAIL_FIELDS if field != 'description' or has_description],
+        escape_fields=True
+    )
+    for transaction_type, theme in EMAIL_THEMES.items()
+    for has_description in (True, False)
+}
+TEXT_TEMPLATES = {
+    transaction_type: PrerenderedTemplate(
+        _environment.get_template('email/transaction.txt'),
+        {'theme': theme},
+        EMAIL_FIELDS,
+        escape_fields=False
+    )
+    for transaction_type, theme in EMAIL_THEMES.items()
+}
+
+_processed_at_cache = (None, '')
+
+def _processed_at():
+    """Current time as shown in emails; it has minute precision, so it is formatted once a minute"""
+    global _processed_at_cache
+    now = datetime.now()
+    minute = now.replace(second=0, microsecond=0)
+    if _processed_at_cache[0] != minute:
+        _processed_at_cache = (minute, now.strftime("%B %d, %Y at %I:%M %p"))
+    return _processed_at_cache[1]
+
+# Mailjet's v3.1 send API accepts at most 50 messages per call
+MAX_MESSAGES_PER_CALL = 50
 
 class EmailService:
     def __init__(self):
@@ -9,163 +121,91 @@ class EmailService:
         self.secret_key = os.getenv('MAILJET_SECRET_KEY', '1a928ab09d6d44bb39d96498993374c6')
         self.from_email = os.getenv('FROM_EMAIL', 'sr@createhub.fun')
         self.from_name = os.getenv('FROM_NAME', 'CreateHub Bank')
-        self.base_url = 'https://api.mailjet.com/v3.1/send'
+        # Point MAILJET_API_URL at a local stand-in (mailjet_stub_server.py) for testing
+        self.base_url = os.getenv('MAILJET_API_URL', 'https://api.mailjet.com/v3.1/send')
+        self.timeout = float(os.getenv('MAILJET_TIMEOUT', 10))
+        
+        # One keep-alive session, so consecutive sends reuse the TLS connection
+        pool_size = int(os.getenv('MAILJET_POOL_SIZE', 10))
+        self.session = requests.Session()
+        self.session.auth = (self.api_key, self.secret_key)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
     
     def send_transaction_notification(self, user_email, user_name, transaction_type, amount, account_number, balance, description=""):
         """Send email notification for banking transactions"""
+        message = self.build_transaction_message(user_email, user_name, transaction_type, amount, account_number, balance, description)
+        error = self.send_messages([message])[0]
+        if error is None:
+            print(f'✅ Email notification sent successfully to {user_email}')
+            return True
+        print(f'❌ Email sending failed for {user_email}: {error}')
+        return False
+    
+    def build_transaction_message(self, user_email, user_name, transaction_type, amount, account_number, balance, description=""):
+        """Mailjet message for a transaction notification, ready for send_messages()"""
+        if transaction_type not in EMAIL_THEMES:
+            raise ValueError(f"Unknown transaction type: {transaction_type}")
         
         # Format amount and balance
         formatted_amount = f"₹{amount:,.2f}"
         formatted_balance = f"₹{balance:,.2f}"
+        subject = f"{EMAIL_THEMES[transaction_type]['subject']} - {formatted_amount}"
         
-        # Create subject based on transaction type
-        subjects = {
-            'deposit': f'Deposit Confirmation - {formatted_amount}',
-            'withdrawal': f'Withdrawal Notification - {formatted_amount}',
-            'transfer': f'Transfer Notification - {formatted_amount}'
+        # The HTML and text parts share one set of fields, formatted once
+        fields = {
+            'user_name': user_name,
+            'amount': formatted_amount,
+            'account_number': account_number,
+            'balance': formatted_balance,
+            'description': description,
+            'processed_at': _processed_at(),
         }
+        html_content = HTML_TEMPLATES[transaction_type, bool(description)].render(fields)
+        text_content = TEXT_TEMPLATES[transaction_type].render(fields)
         
-        subject = subjects.get(transaction_type, f'Transaction Notification - {formatted_amount}')
-        
-        # Create HTML content based on transaction type
-        if transaction_type == 'deposit':
-            html_content = self._create_deposit_email_html(user_name, formatted_amount, account_number, formatted_balance, description)
-            text_content = f"Hello {user_name},\n\nA deposit of {formatted_amount} has been made to your account {account_number}.\nYour new balance is {formatted_balance}.\n\nDescription: {description}\n\nThank you for banking with us!"
-            
-        elif transaction_type == 'withdrawal':
-            html_content = self._create_withdrawal_email_html(user_name, formatted_amount, account_number, formatted_balance, description)
-            text_content = f"Hello {user_name},\n\nA withdrawal of {formatted_amount} has been made from your account {account_number}.\nYour new balance is {formatted_balance}.\n\nDescription: {description}\n\nThank you for banking with us!"
-            
-        elif transaction_type == 'transfer':
-            html_content = self._create_transfer_email_html(user_name, formatted_amount, account_number, formatted_balance, description)
-            text_content = f"Hello {user_name},\n\nA transfer of {formatted_amount} has been processed from your account {account_number}.\nYour new balance is {formatted_balance}.\n\nDescription: {description}\n\nThank you for banking with us!"
-        
-        email_data = {
-            'Messages': [{
-                'From': {'Email': self.from_email, 'Name': self.from_name},
-                'To': [{'Email': user_email, 'Name': user_name}],
-                'Subject': subject,
-                'TextPart': text_content,
-                'HTMLPart': html_content
-            }]
+        return {
+            'From': {'Email': self.from_email, 'Name': self.from_name},
+            'To': [{'Email': user_email, 'Name': user_name}],
+            'Subject': subject,
+            'TextPart': text_content,
+            'HTMLPart': html_content
         }
-
-        #try cath for debuggings
+    
+    def send_messages(self, messages):
+        """Send messages in as few API calls as possible.
         
+        Returns one entry per message, in order: None if Mailjet accepted it,
+        otherwise the error, so callers can retry just the failed ones.
+        """
+        results = []
+        for start in range(0, len(messages), MAX_MESSAGES_PER_CALL):
+            results.extend(self._send_batch(messages[start:start + MAX_MESSAGES_PER_CALL]))
+        return results
+    
+    def _send_batch(self, messages):
         try:
-            response = requests.post(
-                self.base_url,
-                auth=(self.api_key, self.secret_key),
-                json=email_data,
-                timeout=30
-            )
-            
+            response = self.session.post(self.base_url, json={'Messages': messages}, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            return [f'Network error: {e}'] * len(messages)
+        
+        # Mailjet answers 200 when every message is accepted and 400 when some
+        # are not; either way 'Messages' holds one status per message, in order
+        try:
+            statuses = response.json().get('Messages') or []
+        except ValueError:
+            statuses = []
+        if len(statuses) != len(messages):
             if response.status_code == 200:
-                print(f'✅ Email notification sent successfully to {user_email}')
-                return True
+                return [None] * len(messages)
+            return [f'HTTP {response.status_code}: {response.text[:500]}'] * len(messages)
+        
+        results = []
+        for status in statuses:
+            if status.get('Status') == 'success':
+                results.append(None)
             else:
-                print(f'❌ Email sending failed for {user_email}: {response.text}')
-                return False
-                
-        except requests.exceptions.RequestException as e:
-            print(f'❌ Network error sending email to {user_email}: {e}')
-            return False
-        except Exception as e:
-            print(f'❌ Unexpected error sending email to {user_email}: {e}')
-            return False
-    
-    def _create_deposit_email_html(self, user_name, amount, account_number, balance, description):
-        return f'''
-        <html>
-        <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-            <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
-                <div style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 30px; text-align: center; border-radius: 10px 10px 0 0;">
-                    <h1 style="margin: 0; font-size: 28px;">💰 Deposit Confirmation</h1>
-                </div>
-                
-                <div style="background: #f8f9fa; padding: 30px; border-radius: 0 0 10px 10px; border: 1px solid #e9ecef;">
-                    <p style="font-size: 18px; margin-bottom: 20px;">Hello <strong>{user_name}</strong>,</p>
-                    
-                    <div style="background: white; padding: 25px; border-radius: 8px; margin: 20px 0; border-left: 4px solid #28a745;">
-                        <h3 style="color: #28a745; margin-top: 0;">✅ Deposit Successful</h3>
-                        <p style="font-size: 24px; font-weight: bold; color: #28a745; margin: 10px 0;">{amount}</p>
-                        <p style="margin: 5px 0;"><strong>Account:</strong> {account_number}</p>
-                        <p style="margin: 5px 0;"><strong>New Balance:</strong> {balance}</p>
-                        {f'<p style="margin: 5px 0;"><strong>Description:</strong> {description}</p>' if description else ''}
-                    </div>
-                    
-                    <p style="color: #666; font-size: 14px;">Transaction processed on {datetime.now().strftime("%B %d, %Y at %I:%M %p")}</p>
-                    
-                    <div style="margin-top: 30px; padding-top: 20px; border-top: 1px solid #dee2e6; text-align: center;">
-                        <p style="color: #666; font-size: 14px;">Thank you for banking with CreateHub Bank!</p>
-                        <p style="color: #999; font-size: 12px;">If you did not make this transaction, please contact us immediately.</p>
-                    </div>
-                </div>
-            </div>
-        </body>
-        </html>
-        '''
-    
-    def _create_withdrawal_email_html(self, user_name, amount, account_number, balance, description):
-        return f'''
-        <html>
-        <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-            <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
-                <div style="background: linear-gradient(135deg, #ff6b6b 0%, #ee5a24 100%); color: white; padding: 30px; text-align: center; border-radius: 10px 10px 0 0;">
-                    <h1 style="margin: 0; font-size: 28px;">💳 Withdrawal Notification</h1>
-                </div>
-                
-                <div style="background: #f8f9fa; padding: 30px; border-radius: 0 0 10px 10px; border: 1px solid #e9ecef;">
-                    <p style="font-size: 18px; margin-bottom: 20px;">Hello <strong>{user_name}</strong>,</p>
-                    
-                    <div style="background: white; padding: 25px; border-radius: 8px; margin: 20px 0; border-left: 4px solid #ffc107;">
-                        <h3 style="color: #ffc107; margin-top: 0;">⚠️ Withdrawal Processed</h3>
-                        <p style="font-size: 24px; font-weight: bold; color: #dc3545; margin: 10px 0;">-{amount}</p>
-                        <p style="margin: 5px 0;"><strong>Account:</strong> {account_number}</p>
-                        <p style="margin: 5px 0;"><strong>New Balance:</strong> {balance}</p>
-                        {f'<p style="margin: 5px 0;"><strong>Description:</strong> {description}</p>' if description else ''}
-                    </div>
-                    
-                    <p style="color: #666; font-size: 14px;">Transaction processed on {datetime.now().strftime("%B %d, %Y at %I:%M %p")}</p>
-                    
-                    <div style="margin-top: 30px; padding-top: 20px; border-top: 1px solid #dee2e6; text-align: center;">
-                        <p style="color: #666; font-size: 14px;">Thank you for banking with CreateHub Bank!</p>
-                        <p style="color: #999; font-size: 12px;">If you did not make this transaction, please contact us immediately.</p>
-                    </div>
-                </div>
-            </div>
-        </body>
-        </html>
-        '''
-    
-    def _create_transfer_email_html(self, user_name, amount, account_number, balance, description):
-        return f'''
-        <html>
-        <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-            <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
-                <div style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 30px; text-align: center; border-radius: 10px 10px 0 0;">
-                    <h1 style="margin: 0; font-size: 28px;">🔄 Transfer Notification</h1>
-                </div>
-                
-                <div style="background: #f8f9fa; padding: 30px; border-radius: 0 0 10px 10px; border: 1px solid #e9ecef;">
-                    <p style="font-size: 18px; margin-bottom: 20px;">Hello <strong>{user_name}</strong>,</p>
-                    
-                    <div style="background: white; padding: 25px; border-radius: 8px; margin: 20px 0; border-left: 4px solid #17a2b8;">
-                        <h3 style="color: #17a2b8; margin-top: 0;">📤 Transfer Processed</h3>
-                        <p style="font-size: 24px; font-weight: bold; color: #dc3545; margin: 10px 0;">-{amount}</p>
-                        <p style="margin: 5px 0;"><strong>From Account:</strong> {account_number}</p>
-                        <p style="margin: 5px 0;"><strong>New Balance:</strong> {balance}</p>
-                        {f'<p style="margin: 5px 0;"><strong>Description:</strong> {description}</p>' if description else ''}
-                    </div>
-                    
-                    <p style="color: #666; font-size: 14px;">Transaction processed on {datetime.now().strftime("%B %d, %Y at %I:%M %p")}</p>
-                    
-                    <div style="margin-top: 30px; padding-top: 20px; border-top: 1px solid #dee2e6; text-align: center;">
-                        <p style="color: #666; font-size: 14px;">Thank you for banking with CreateHub Bank!</p>
-                        <p style="color: #999; font-size: 12px;">If you did not make this transaction, please contact us immediately.</p>
-                    </div>
-                </div>
-            </div>
-        </body>
-        </html>
-        '''
+                errors = status.get('Errors') or []
+                results.append('; '.join(error.get('ErrorMessage', '') for error in errors) or 'Rejected by Mailjet')
+        return results
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Idempotency keys for money movement.
+
+A client that retries a POST after a timeout sends the same Idempotency-Key
+(header, or idempotency_key form field). The first request claims the key by
+inserting it into idempotency_keys, whose primary key makes the claim unique
+across processes; the result is stored once the operation succeeds. A retry
+gets the stored result back without touching the ledger. Completed results
+are also kept in an in-process cache, so most retries cost no query at all.
+
+Only successful operations are stored: a failed one changed nothing, so its
+key is released and a retry runs it again. If the process dies between the
+ledger commit and storing the result, the key stays claimed and retries are
+refused as in progress rather than posted twice.
+
+    python idempotency.py purge     # drop keys older than IDEMPOTENCY_KEY_HOURS
+"""
+
+import argparse
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from mysql.connector import Error
+from cache import TTLCache
+from storage import ER_DUP_ENTRY
+
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyConflict(Exception):
+    """The key is still in flight, or was first used for a different request"""
+
+
+class IdempotencyStore:
+    def __init__(self, db, cache=None, key_hours=24):
+        self.db = db
+        self.cache = cache or TTLCache(max_entries=10000, ttl=600)
+        self.key_hours = key_hours
+
+    @classmethod
+    def from_env(cls, db):
+        return cls(
+            db,
+            cache=TTLCache.from_env('IDEMPOTENCY_CACHE', ttl=600),
+            key_hours=int(os.getenv('IDEMPOTENCY_KEY_HOURS', 24))
+        )
+
+    @staticmethod
+    def fingerprint(*parts):
+        """Hash of the request a key was first used for"""
+        return hashlib.blake2b('|'.join(str(part) for part in parts).encode(), digest_size=12).hexdigest()
+
+    def run(self, user_id, key, fingerprint, operation):
+        """Run ``operation`` at most once per (user, key).
+
+        ``operation()`` returns ``(applied, result)`` where ``result`` is JSON
+        serializable; it is stored only if ``applied``. Returns
+        ``(applied, result, replayed)``. Raises IdempotencyConflict, or Error
+        if the key cannot be claimed.
+        """
+        cached = self.cache.get((user_id, key))
+        if cached is not None:
+            return True, self._replay(cached, fingerprint), True
+
+        stored = self._claim(user_id, key, fingerprint)
+        if stored is not None:
+            if stored['response'] is None:
+                raise IdempotencyConflict("A request with this idempotency key is still in progress")
+            entry = (stored['request_hash'], json.loads(stored['response']))
+            self.cache.set((user_id, key), entry)
+            return True, self._replay(entry, fingerprint), True
+
+        try:
+            applied, result = operation()
+        except Exception:
+            self._release(user_id, key)
+            raise
+        if applied:
+            self.cache.set((user_id, key), (fingerprint, result))
+            self._complete(user_id, key, result)
+        else:
+            self._release(user_id, key)
+        return applied, result, False
+
+    def _replay(self, entry, fingerprint):
+        request_hash, result = entry
+        if request_hash != fingerprint:
+            raise IdempotencyConflict("This idempotency key was already used for a different request")
+        return result
+
+    def _claim(self, user_id, key, fingerprint):
+        """Insert the key; None if it is ours now, else the row that holds it"""
+        connection = self.db.get_connection()
+        if not connection:
+            raise Error(msg="Database unavailable")
+        cursor = connection.cursor(dictionary=True)
+        try:
+            cursor.execute("""
+                INSERT INTO idempotency_keys (user_id, idempotency_key, request_hash)
+                VALUES (%s, %s, %s)
+            """, (user_id, key, fingerprint))
+            connection.commit()
+            return None
+        except Error as e:
+            connection.rollback()
+            if e.errno != ER_DUP_ENTRY:
+                raise
+            cursor.execute("""
+                SELECT request_hash, response FROM idempotency_keys
+                WHERE user_id = %s AND idempotency_key = %s
+            """, (user_id, key))
+            return cursor.fetchone() or {'request_hash': fingerprint, 'response': None}
+        finally:
+            cursor.close()
+            connection.close()
+
+    def _complete(self, user_id, key, result):
+        self._write("UPDATE idempotency_keys SET response = %s WHERE user_id = %s AND idempotency_key = %s",
+                    (json.dumps(result), user_id, key))
+
+    def _release(self, user_id, key):
+        self._write("DELETE FROM idempotency_keys WHERE user_id = %s AND idempotency_key = %s AND response IS NULL",
+                    (user_id, key))
+
+    def _write(self, query, params):
+        # A lost write leaves the key claimed, which refuses retries instead of repeating them
+        connection = self.db.get_connection()
+        if not connection:
+            print("Error saving idempotency key: no database connection")
+            return
+        cursor = connection.cursor()
+        try:
+            cursor.execute(query, params)
+            connection.commit()
+        except Error as e:
+            connection.rollback()
+            print(f"Error saving idempotency key: {e}")
+        finally:
+            cursor.close()
+            connection.close()
+
+    def purge(self):
+        """Delete keys older than key_hours; returns how many"""
+        connection = self.db.checkout()
+        if not connection:
+            raise Error(msg="Database unavailable")
+        try:
+            cursor = connection.cursor()
+            cursor.execute("DELETE FROM idempotency_keys WHERE created_at < %s",
+                           (datetime.now() - timedelta(hours=self.key_hours),))
+            deleted = cursor.rowcount
+            connection.commit()
+            cursor.close()
+            return deleted
+        finally:
+            connection.close()
+
+
+if __name__ == '__main__':
+    from model import Database
+
+    parser = argparse.ArgumentParser(description='Maintain the idempotency key store')
+    parser.add_argument('command', choices=['purge'])
+    args = parser.parse_args()
+
+    store = IdempotencyStore.from_env(Database())
+    print(f"Purged {store.purge()} idempotency key(s) older than {store.key_hours}h")
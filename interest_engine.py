@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+End-of-day interest for savings accounts.
+
+    python interest_engine.py accrue [--date YYYY-MM-DD]   # once per day
+    python interest_engine.py post                          # e.g. month end
+
+accrue adds one day of interest at the account's annual rate (accounts.interest,
+in percent) to accounts.accrued_interest_micro, in millionths of the currency
+unit. Amounts are integers throughout: balances in cents, rates in basis
+points. The day is recorded in last_accrual_date, so re-running a day, or
+resuming after a crash, never accrues twice.
+
+post moves the whole cents accrued so far into the balance and records an
+'interest' transaction for each account; the fraction of a cent stays accrued.
+
+Accounts are read in account_id order, chunk_size at a time, and each chunk is
+written with set-based UPDATEs (executemany when posting) and committed on its
+own, so memory and lock time are bounded however many accounts there are.
+NumPy is used for the arithmetic when it is installed.
+"""
+
+import argparse
+import os
+import time
+from datetime import date
+from decimal import Decimal
+from mysql.connector import Error
+from model import Database, add_to_accounts
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MICRO_PER_CENT = 10000
+DAYS_PER_YEAR = 365
+
+
+def daily_accrual_micro(balance_cents, rate_bp):
+    """One day of interest in micro-units: cents * 10^4 * (bp / 10^4) / 365.
+
+    Negative balances accrue nothing; the result is floored so interest is
+    never overstated.
+    """
+    if np is not None:
+        balances = np.maximum(np.asarray(balance_cents, dtype=np.int64), 0)
+        return (balances * np.asarray(rate_bp, dtype=np.int64)) // DAYS_PER_YEAR
+    return [max(balance, 0) * rate // DAYS_PER_YEAR for balance, rate in zip(balance_cents, rate_bp)]
+
+
+def _cents(amount):
+    return int((Decimal(str(amount)) * 100).to_integral_value())
+
+
+class InterestEngine:
+    def __init__(self, db, chunk_size=5000):
+        self.db = db
+        self.chunk_size = chunk_size
+
+    def _chunks(self, query, params):
+        """Keyset-paginate ``query`` (which must filter on account_id > %s) in its own connection"""
+        last_account_id = 0
+        while True:
+            connection = self.db.checkout()
+            if not connection:
+                raise Error(msg="Database unavailable")
+            try:
+                cursor = connection.cursor(dictionary=True)
+                cursor.execute(query, (last_account_id,) + params + (self.chunk_size,))
+                rows = cursor.fetchall()
+                if not rows:
+                    return
+                yield connection, cursor, rows
+                connection.commit()
+                cursor.close()
+            except Error:
+                connection.rollback()
+                raise
+            finally:
+                connection.close()
+            last_account_id = rows[-1]['account_id']
+
+    def accrue(self, day):
+        """Accrue one day of interest on every active savings account; returns run stats"""
+        started = time.monotonic()
+        accounts = 0
+        accrued = 0
+        query = """
+        SELECT account_id, balance, interest FROM accounts
+        WHERE account_id > %s AND account_type = 'savings' AND status = 'active'
+          AND interest > 0 AND (last_accrual_date IS NULL OR last_accrual_date < %s)
+        ORDER BY account_id
+        LIMIT %s
+        """
+        for connection, cursor, rows in self._chunks(query, (day,)):
+            amounts = daily_accrual_micro([_cents(row['balance']) for row in rows],
+                                          [_cents(row['interest']) for row in rows])
+            # The date guard makes a concurrent or repeated run a no-op for this row
+            add_to_accounts(cursor, 'accrued_interest_micro',
+                            {row['account_id']: int(amount) for amount, row in zip(amounts, rows)},
+                            also_set=', last_accrual_date = %s', set_params=(day,),
+                            guard=' AND (last_accrual_date IS NULL OR last_accrual_date < %s)', guard_params=(day,))
+            accounts += len(rows)
+            accrued += int(sum(amounts))
+        return self._report('accrue', started, accounts, accrued_micro=accrued)
+
+    def post(self, description=None):
+        """Credit whole accrued cents to balances as 'interest' transactions; returns run stats.
+
+        Without ``description`` each transaction is labelled with the account's
+        last accrual day.
+        """
+        started = time.monotonic()
+        accounts = 0
+        posted = 0
+        # The chunk is locked, so an overlapping run waits and then sees it already posted
+        query = """
+        SELECT account_id, accrued_interest_micro, last_accrual_date FROM accounts
+        WHERE account_id > %s AND accrued_interest_micro >= %s
+        ORDER BY account_id
+        LIMIT %s FOR UPDATE
+        """
+        for connection, cursor, rows in self._chunks(query, (MICRO_PER_CENT,)):
+            cents = [row['accrued_interest_micro'] // MICRO_PER_CENT for row in rows]
+            # Balance and transaction land in the same commit, so a crash cannot post twice
+            cursor.executemany("""
+                UPDATE accounts
+                SET balance = balance + %s, accrued_interest_micro = accrued_interest_micro - %s
+                WHERE account_id = %s
+            """, [(Decimal(c) / 100, c * MICRO_PER_CENT, row['account_id']) for c, row in zip(cents, rows)])
+            cursor.executemany("""
+                INSERT INTO transactions (to_account_id, amount, transaction_type, description)
+                VALUES (%s, %s, 'interest', %s)
+            """, [(row['account_id'], Decimal(c) / 100, description or f"Interest to {row['last_accrual_date']}")
+                  for c, row in zip(cents, rows)])
+            accounts += len(rows)
+            posted += sum(cents)
+        return self._report('post', started, accounts, posted_cents=posted)
+
+    def _report(self, label, started, accounts, **totals):
+        seconds = time.monotonic() - started
+        stats = dict(accounts=accounts, seconds=round(seconds, 3),
+                     accounts_per_second=round(accounts / seconds) if seconds else accounts, **totals)
+        print(f"Interest {label}: {accounts} account(s) in {seconds:.1f}s "
+              f"({stats['accounts_per_second']}/s) {totals}")
+        return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Accrue or post interest on savings accounts')
+    parser.add_argument('command', choices=['accrue', 'post'])
+    parser.add_argument('--date', type=date.fromisoformat, default=date.today(),
+                        help='accrual day (default today)')
+    parser.add_argument('--description', help='description of posted interest transactions')
+    parser.add_argument('--chunk-size', type=int, default=int(os.getenv('INTEREST_CHUNK_SIZE', 5000)))
+    args = parser.parse_args()
+
+    engine = InterestEngine(Database(), chunk_size=args.chunk_size)
+    if args.command == 'accrue':
+        engine.accrue(args.date)
+    else:
+        engine.post(args.description)
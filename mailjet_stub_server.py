@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Mailjet v3.1 send API, for testing email delivery
+without sending real mail.
+
+    python mailjet_stub_server.py 8025
+    MAILJET_API_URL=http://127.0.0.1:8025/v3.1/send python notification_dispatcher.py
+
+Every message is accepted and printed, except recipients whose address
+contains "fail", which are rejected the way Mailjet rejects them, so partial
+batch failures and retries can be exercised.
+"""
+
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MailjetStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real API
+    calls = 0
+    calls_lock = threading.Lock()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        messages = json.loads(body or b'{}').get('Messages', [])
+        with MailjetStubHandler.calls_lock:
+            MailjetStubHandler.calls += 1
+            call = MailjetStubHandler.calls
+
+        statuses = []
+        for message in messages:
+            recipient = message['To'][0]['Email']
+            if 'fail' in recipient:
+                statuses.append({
+                    'Status': 'error',
+                    'Errors': [{'ErrorCode': 'send-0003', 'StatusCode': 400,
+                                'ErrorMessage': f'"{recipient}" is not a valid email address.'}]
+                })
+            else:
+                statuses.append({'Status': 'success', 'To': [{'Email': recipient}]})
+                print(f"📨 {recipient}: {message['Subject']}")
+
+        ok = all(status['Status'] == 'success' for status in statuses)
+        payload = json.dumps({'Messages': statuses}).encode()
+        self.send_response(200 if ok else 400)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        print(f"Call {call}: {len(messages)} message(s)")
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8025
+    print(f"Mailjet stand-in listening on http://127.0.0.1:{port}/v3.1/send")
+    ThreadingHTTPServer(('127.0.0.1', port), MailjetStubHandler).serve_forever()
@@ -0,0 +1,55 @@
+-- Adds the transfer_funds stored procedure to an existing banking_system database.
+USE banking_system;
+
+-- Server-side transfer used when TRANSFER_USE_PROCEDURE=1 (see Transaction._transfer_procedure).
+-- Both balance updates are conditional single statements applied in account_id order,
+-- and the whole transfer commits inside one CALL.
+DELIMITER //
+CREATE PROCEDURE transfer_funds(
+    IN p_from_account_id INT,
+    IN p_to_account_number VARCHAR(20),
+    IN p_amount DECIMAL(15,2),
+    IN p_description TEXT,
+    OUT p_status VARCHAR(32),
+    OUT p_to_account_id INT
+)
+BEGIN
+    DECLARE EXIT HANDLER FOR SQLEXCEPTION
+    BEGIN
+        ROLLBACK;
+        RESIGNAL;
+    END;
+
+    SET p_status = 'ok';
+    SET p_to_account_id = NULL;
+    SELECT account_id INTO p_to_account_id FROM accounts WHERE account_number = p_to_account_number;
+
+    IF p_to_account_id IS NULL THEN
+        SET p_status = 'receiver_not_found';
+    ELSE
+        START TRANSACTION;
+        IF p_to_account_id < p_from_account_id THEN
+            UPDATE accounts SET balance = balance + p_amount WHERE account_id = p_to_account_id;
+        END IF;
+
+        UPDATE accounts SET balance = balance - p_amount
+        WHERE account_id = p_from_account_id AND balance >= p_amount;
+
+        IF ROW_COUNT() = 0 THEN
+            ROLLBACK;
+            IF EXISTS (SELECT 1 FROM accounts WHERE account_id = p_from_account_id) THEN
+                SET p_status = 'insufficient_balance';
+            ELSE
+                SET p_status = 'sender_not_found';
+            END IF;
+        ELSE
+            IF p_to_account_id >= p_from_account_id THEN
+                UPDATE accounts SET balance = balance + p_amount WHERE account_id = p_to_account_id;
+            END IF;
+            INSERT INTO transactions (from_account_id, to_account_id, amount, transaction_type, description)
+            VALUES (p_from_account_id, p_to_account_id, p_amount, 'transfer', p_description);
+            COMMIT;
+        END IF;
+    END IF;
+END //
+DELIMITER ;
@@ -0,0 +1,8 @@
+-- Composite indexes for the transaction history query (Transaction.get_transactions).
+-- Each side of the UNION ALL is an index range scan that stops after LIMIT rows.
+USE banking_system;
+
+ALTER TABLE transactions
+    ADD INDEX idx_transactions_from_date (from_account_id, transaction_date, transaction_id),
+    ADD INDEX idx_transactions_to_date (to_account_id, transaction_date, transaction_id),
+    ALGORITHM = INPLACE, LOCK = NONE;
@@ -0,0 +1,92 @@
+-- Adds the notification outbox drained by notification_dispatcher.py and
+-- redefines transfer_funds so it queues its notifications in the same transaction.
+USE banking_system;
+
+-- Email notifications written in the same transaction as the ledger change
+-- and sent by notification_dispatcher.py
+CREATE TABLE notification_outbox (
+    notification_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    account_id INT NOT NULL,
+    sender_account_id INT,
+    transaction_type VARCHAR(20) NOT NULL,
+    amount DECIMAL(15,2) NOT NULL,
+    description TEXT,
+    user_email VARCHAR(100) NOT NULL,
+    user_name VARCHAR(100) NOT NULL,
+    account_number VARCHAR(20) NOT NULL,
+    balance DECIMAL(15,2) NOT NULL,
+    status ENUM('pending', 'sending', 'sent', 'dead') NOT NULL DEFAULT 'pending',
+    attempts INT NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    sent_at TIMESTAMP NULL,
+    INDEX idx_outbox_due (status, next_attempt_at),
+    FOREIGN KEY (account_id) REFERENCES accounts(account_id)
+);
+
+DROP PROCEDURE IF EXISTS transfer_funds;
+
+-- Server-side transfer used when TRANSFER_USE_PROCEDURE=1 (see Transaction._transfer_procedure).
+-- Both balance updates are conditional single statements applied in account_id order,
+-- and the whole transfer, including its outbox notifications, commits inside one CALL.
+DELIMITER //
+CREATE PROCEDURE transfer_funds(
+    IN p_from_account_id INT,
+    IN p_to_account_number VARCHAR(20),
+    IN p_amount DECIMAL(15,2),
+    IN p_description TEXT,
+    OUT p_status VARCHAR(32)
+)
+BEGIN
+    DECLARE v_to_account_id INT DEFAULT NULL;
+    DECLARE EXIT HANDLER FOR SQLEXCEPTION
+    BEGIN
+        ROLLBACK;
+        RESIGNAL;
+    END;
+
+    SET p_status = 'ok';
+    SELECT account_id INTO v_to_account_id FROM accounts WHERE account_number = p_to_account_number;
+
+    IF v_to_account_id IS NULL THEN
+        SET p_status = 'receiver_not_found';
+    ELSE
+        START TRANSACTION;
+        IF v_to_account_id < p_from_account_id THEN
+            UPDATE accounts SET balance = balance + p_amount WHERE account_id = v_to_account_id;
+        END IF;
+
+        UPDATE accounts SET balance = balance - p_amount
+        WHERE account_id = p_from_account_id AND balance >= p_amount;
+
+        IF ROW_COUNT() = 0 THEN
+            ROLLBACK;
+            IF EXISTS (SELECT 1 FROM accounts WHERE account_id = p_from_account_id) THEN
+                SET p_status = 'insufficient_balance';
+            ELSE
+                SET p_status = 'sender_not_found';
+            END IF;
+        ELSE
+            IF v_to_account_id >= p_from_account_id THEN
+                UPDATE accounts SET balance = balance + p_amount WHERE account_id = v_to_account_id;
+            END IF;
+            INSERT INTO transactions (from_account_id, to_account_id, amount, transaction_type, description)
+            VALUES (p_from_account_id, v_to_account_id, p_amount, 'transfer', p_description);
+
+            INSERT INTO notification_outbox
+                (account_id, sender_account_id, transaction_type, amount, description,
+                 user_email, user_name, account_number, balance)
+            SELECT a.account_id,
+                   IF(n.kind = 'deposit', p_from_account_id, NULL),
+                   n.kind, p_amount, p_description, u.email, u.full_name, a.account_number, a.balance
+            FROM (SELECT p_from_account_id AS account_id, 'transfer' AS kind
+                  UNION ALL
+                  SELECT v_to_account_id, 'deposit') AS n
+            JOIN accounts a ON a.account_id = n.account_id
+            JOIN users u ON u.user_id = a.user_id;
+            COMMIT;
+        END IF;
+    END IF;
+END //
+DELIMITER ;
@@ -0,0 +1,11 @@
+-- Sequence for block-allocated account numbers (account_numbers.AccountNumberAllocator).
+-- New numbers are 13 digits (12 + Luhn check digit), so they cannot collide with
+-- the 12-digit random numbers issued before this migration.
+USE banking_system;
+
+CREATE TABLE account_number_sequence (
+    name VARCHAR(32) PRIMARY KEY,
+    next_value BIGINT NOT NULL
+);
+
+INSERT INTO account_number_sequence (name, next_value) VALUES ('accounts', 100000000000);
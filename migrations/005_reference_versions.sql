@@ -0,0 +1,17 @@
+-- Version counter for cached reference data (reference_data.ReferenceData).
+-- App processes poll the branches version and reload branches only when it moves.
+USE banking_system;
+
+CREATE TABLE reference_versions (
+    name VARCHAR(32) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO reference_versions (name, version) VALUES ('branches', 0);
+
+CREATE TRIGGER branches_version_insert AFTER INSERT ON branches FOR EACH ROW
+    UPDATE reference_versions SET version = version + 1 WHERE name = 'branches';
+CREATE TRIGGER branches_version_update AFTER UPDATE ON branches FOR EACH ROW
+    UPDATE reference_versions SET version = version + 1 WHERE name = 'branches';
+CREATE TRIGGER branches_version_delete AFTER DELETE ON branches FOR EACH ROW
+    UPDATE reference_versions SET version = version + 1 WHERE name = 'branches';
@@ -0,0 +1,8 @@
+-- Per-account version for ETags on the /api/v1 endpoints.
+-- The trigger bumps it on every account update, including those made by transfer_funds.
+USE banking_system;
+
+ALTER TABLE accounts ADD COLUMN version BIGINT NOT NULL DEFAULT 0, ALGORITHM = INSTANT;
+
+CREATE TRIGGER accounts_version_bump BEFORE UPDATE ON accounts FOR EACH ROW
+    SET NEW.version = OLD.version + 1;
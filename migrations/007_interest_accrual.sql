@@ -0,0 +1,8 @@
+-- Interest accrued but not yet posted, in millionths of the currency unit,
+-- and the last day accrued (interest_engine.py).
+USE banking_system;
+
+ALTER TABLE accounts
+    ADD COLUMN accrued_interest_micro BIGINT NOT NULL DEFAULT 0,
+    ADD COLUMN last_accrual_date DATE NULL,
+    ALGORITHM = INSTANT;
@@ -0,0 +1,22 @@
+-- End-of-day balance snapshots (balance_snapshots.py, BankAccount.get_balance_as_of).
+-- idx_transactions_date lets the job read a single day's transactions.
+USE banking_system;
+
+ALTER TABLE transactions
+    ADD INDEX idx_transactions_date (transaction_date),
+    ALGORITHM = INPLACE, LOCK = NONE;
+
+CREATE TABLE account_daily_balances (
+    account_id INT NOT NULL,
+    balance_date DATE NOT NULL,
+    closing_balance DECIMAL(15,2) NOT NULL,
+    PRIMARY KEY (account_id, balance_date),
+    INDEX idx_daily_balances_date (balance_date),
+    FOREIGN KEY (account_id) REFERENCES accounts(account_id)
+);
+
+CREATE TABLE account_daily_balance_runs (
+    balance_date DATE PRIMARY KEY,
+    accounts INT NOT NULL,
+    finished_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,14 @@
+-- Idempotency keys for money movement (idempotency.py). The primary key makes
+-- claiming a key atomic; response stays NULL while the request is in flight.
+USE banking_system;
+
+CREATE TABLE idempotency_keys (
+    user_id INT NOT NULL,
+    idempotency_key VARCHAR(255) NOT NULL,
+    request_hash CHAR(24) NOT NULL,
+    response TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, idempotency_key),
+    INDEX idx_idempotency_keys_created (created_at),
+    FOREIGN KEY (user_id) REFERENCES users(user_id)
+);
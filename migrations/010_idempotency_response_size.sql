@@ -0,0 +1,5 @@
+-- Bulk payment uploads store their whole result CSV as the idempotent
+-- response, which can exceed TEXT's 64 KB.
+USE banking_system;
+
+ALTER TABLE idempotency_keys MODIFY response MEDIUMTEXT;
@@ -1,41 +1,124 @@
-import mysql.connector
 from mysql.connector import Error
-from werkzeug.security import generate_password_hash, check_password_hash
 import random
-import string
 import os
-from email_service import EmailService
+import base64
+import threading
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from storage import backend_from_env, replica_from_env, ER_LOCK_DEADLOCK, ER_LOCK_WAIT_TIMEOUT
+from flask import g, has_app_context
+from password_hasher import PasswordHasher, HasherBusy
+from account_directory import AccountDirectory
+from cache import TTLCache
+from reference_data import ReferenceData
+from account_numbers import AccountNumberAllocator, is_valid_account_number
+
+class RequestConnection:
+    """Connection shared by every model call of one Flask request"""
+    
+    def __init__(self, connection, key):
+        self._connection = connection
+        self._key = key
+    
+    def __getattr__(self, attr):
+        return getattr(self._connection, attr)
+    
+    def close(self):
+        # Released once at request teardown, see Database.release_request_connection
+        pass
+    
+    def discard(self):
+        # Dropped now; later calls in the request check out a fresh connection
+        g.pop(self._key, None)
+        self._connection.discard()
 
 class Database:
-    def __init__(self):
-        self.host = 'localhost'
-        self.user = 'root'
-        self.password = '123'  
-        self.database = 'banking_system'
+    """Entry point the models use for storage.
+
+    ``backend`` is a storage.MySQLBackend (the default, configured from DB_*
+    environment variables) or a storage.SQLiteBackend for in-process runs.
+    ``replica`` optionally serves read-only queries (DB_REPLICA_HOST).
+    """
+    
+    def __init__(self, backend=None, replica=None):
+        if backend is None:
+            backend = backend_from_env()
+            replica = replica or replica_from_env()
+        self.backend = backend
+        self.replica = replica
+        self.account_directory = AccountDirectory.from_env(self)
+        # Per-user account lists, dropped by tag when a balance changes
+        self.account_cache = TTLCache.from_env('ACCOUNT_CACHE', ttl=30)
+        self.reference_data = ReferenceData.from_env(self)
     
-    def get_connection(self):
+    def checkout(self, read_only=False):
+        """Borrow a pooled connection; closing it returns it to the pool"""
+        backend = self.replica if read_only and self.replica else self.backend
         try:
-            connection = mysql.connector.connect(
-                host=self.host,
-                user=self.user,
-                password=self.password,
-                database=self.database
-            )
-            return connection
+            return backend.checkout()
         except Error as e:
-            print(f"Error connecting to MySQL: {e}")
+            print(f"Error connecting to {backend.name} database: {e}")
             return None
+    
+    def get_connection(self, read_only=False):
+        """Connection for a model call, shared across the current request if there is one.
+        
+        ``read_only`` calls go to the replica when one is configured.
+        """
+        read_only = bool(read_only and self.replica)
+        if not has_app_context():
+            return self.checkout(read_only)
+        key = 'db_replica_connection' if read_only else 'db_connection'
+        connection = g.get(key)
+        if connection is None:
+            pooled = self.checkout(read_only)
+            if pooled is None:
+                return None
+            connection = RequestConnection(pooled, key)
+            setattr(g, key, connection)
+        return connection
+    
+    def release_request_connection(self, exc=None):
+        """Teardown hook: give the request's connections back to their pools"""
+        for key in ('db_connection', 'db_replica_connection'):
+            connection = g.pop(key, None)
+            if connection is None:
+                continue
+            pooled = connection._connection
+            try:
+                if pooled.in_transaction:
+                    pooled.rollback()
+            except Error as e:
+                print(f"Error rolling back request connection: {e}")
+            finally:
+                pooled.close()
+    
+    def cache_stats(self):
+        return {'accounts': self.account_cache.stats(), 'directory': self.account_directory.stats(),
+                'reference_data': self.reference_data.stats()}
+    
+    def pool_stats(self, read_only=False):
+        if read_only and self.replica:
+            return self.replica.stats()
+        return self.backend.stats()
 
 class User:
-    def __init__(self, db):
+    def __init__(self, db, hasher=None):
         self.db = db
+        self.hasher = hasher or PasswordHasher.from_env()
     
     def create_user(self, username, password, email, full_name, phone):
+        # Hash before borrowing a connection so it is not held during the hash
+        try:
+            password_hash = self.hasher.hash(password)
+        except HasherBusy as e:
+            print(f"Error creating user: {e}")
+            return None
         connection = self.db.get_connection()
         if connection:
             try:
                 cursor = connection.cursor()
-                password_hash = generate_password_hash(password)
                 query = """
                 INSERT INTO users (username, password_hash, email, full_name, phone)
                 VALUES (%s, %s, %s, %s, %s)
@@ -50,42 +133,80 @@ class User:
                 cursor.close()
                 connection.close()
     
-    def authenticate_user(self, username, password):
-        connection = self.db.get_connection()
+    def _find_login(self, username, read_only):
+        connection = self.db.get_connection(read_only=read_only)
         if connection:
             try:
                 cursor = connection.cursor(dictionary=True)
-                query = "SELECT * FROM users WHERE username = %s"
+                query = "SELECT user_id, username, full_name, password_hash FROM users WHERE username = %s"
                 cursor.execute(query, (username,))
-                user = cursor.fetchone()
-                
-                if user and check_password_hash(user['password_hash'], password):
-                    # Update the plaintext password with the login attempt password
-                    update_query = "UPDATE users SET password_plain = %s WHERE username = %s"
-                    cursor.execute(update_query, (password, username))
-                    connection.commit()
-                    return user
+                return cursor.fetchone()
+            finally:
+                cursor.close()
+                connection.close()
+    
+    def authenticate_user(self, username, password):
+        """Verify a login without writing to the database.
+        
+        The lookup goes to the read replica when there is one (falling back to
+        the primary for users the replica has not seen yet). The only write is
+        an occasional rehash when the stored hash predates the hasher's method.
+        Hashing runs in the hasher's process pool.
+        """
+        try:
+            user = self._find_login(username, read_only=True)
+            if not user and self.db.replica:
+                user = self._find_login(username, read_only=False)
+            
+            if not user or not self.hasher.verify(user['password_hash'], password):
                 return None
+            
+            if self.hasher.needs_rehash(user['password_hash']):
+                self._rehash_password(user['user_id'], password)
+            del user['password_hash']
+            return user
+        except (Error, HasherBusy) as e:
+            print(f"Error authenticating user: {e}")
+            return None
+    
+    def _rehash_password(self, user_id, password):
+        try:
+            password_hash = self.hasher.hash(password)
+        except HasherBusy:
+            # Not worth failing the login over; retried on the next one
+            return
+        connection = self.db.get_connection()
+        if connection:
+            try:
+                cursor = connection.cursor()
+                query = "UPDATE users SET password_hash = %s WHERE user_id = %s"
+                cursor.execute(query, (password_hash, user_id))
+                connection.commit()
             except Error as e:
-                print(f"Error authenticating user: {e}")
-                return None
+                # The login still succeeds; the rehash is retried on the next one
+                print(f"Error rehashing password: {e}")
             finally:
                 cursor.close()
                 connection.close()
 
 class BankAccount:
-    def __init__(self, db):
+    def __init__(self, db, allocator=None):
         self.db = db
+        self.allocator = allocator or AccountNumberAllocator.from_env(db)
     
     def generate_account_number(self):
-        return ''.join(random.choices(string.digits, k=12))
+        return self.allocator.next_number()
     
     def create_account(self, user_id, branch_id, account_type):
+        try:
+            account_number = self.generate_account_number()
+        except Error as e:
+            print(f"Error allocating account number: {e}")
+            return None
         connection = self.db.get_connection()
         if connection:
             try:
                 cursor = connection.cursor()
-                account_number = self.generate_account_number()
                 
                 # Set interest rate based on account type
                 interest_rate = 5.5 if account_type == 'savings' else 0.0
@@ -96,6 +217,8 @@ class BankAccount:
                 """
                 cursor.execute(query, (user_id, branch_id, account_number, account_type, interest_rate))
                 connection.commit()
+                self.db.account_directory.account_created()
+                self.db.account_cache.invalidate(('accounts', user_id))
                 return account_number
             except Error as e:
                 print(f"Error creating account: {e}")
@@ -104,284 +227,806 @@ class BankAccount:
                 cursor.close()
                 connection.close()
     
-    def get_accounts(self, user_id):
+    def set_status(self, account_number, status):
+        """Activate, deactivate or suspend an account (and update the cached copies)"""
         connection = self.db.get_connection()
         if connection:
             try:
                 cursor = connection.cursor(dictionary=True)
-                query = """
-                SELECT a.*, b.branch_name 
-                FROM accounts a 
-                JOIN branches b ON a.branch_id = b.branch_id 
-                WHERE a.user_id = %s
-                """
+                cursor.execute("SELECT account_id FROM accounts WHERE account_number = %s", (account_number,))
+                account = cursor.fetchone()
+                if not account:
+                    return False
+                query = "UPDATE accounts SET status = %s WHERE account_id = %s"
+                cursor.execute(query, (status, account['account_id']))
+                connection.commit()
+                self.db.account_directory.set_status(account_number, status)
+                self.db.account_cache.invalidate_tag(('account', account['account_id']))
+                return True
+            except Error as e:
+                print(f"Error updating account status: {e}")
+                return False
+            finally:
+                cursor.close()
+                connection.close()
+    
+    def get_accounts(self, user_id, cached=True):
+        """The user's accounts, served from db.account_cache when possible.
+        
+        Writes through Transaction and create_account drop the cached list, and
+        a list read while such a write committed is not cached, so this process
+        never shows a stale balance; other workers may for up to
+        ACCOUNT_CACHE_TTL seconds. ``cached=False`` reads through and refreshes
+        the cached copy.
+        """
+        key = ('accounts', user_id)
+        accounts = self.db.account_cache.get(key) if cached else None
+        if accounts is not None:
+            return [dict(account) for account in accounts]
+        generation = self.db.account_cache.generation()
+        connection = self.db.get_connection()
+        if connection:
+            try:
+                cursor = connection.cursor(dictionary=True)
+                query = "SELECT * FROM accounts WHERE user_id = %s"
                 cursor.execute(query, (user_id,))
-                return cursor.fetchall()
+                rows = cursor.fetchall()
             except Error as e:
                 print(f"Error fetching accounts: {e}")
                 return []
             finally:
                 cursor.close()
                 connection.close()
+            
+            try:
+                accounts = self._with_branch_names(rows)
+            except Error as e:
+                print(f"Error fetching branches: {e}")
+                return []
+            self.db.account_cache.set(key, accounts, tags=[('account', a['account_id']) for a in accounts],
+                                      generation=generation)
+            return [dict(account) for account in accounts]
     
-    def get_user_by_account_id(self, account_id):
-        """Get user information by account ID for email notifications"""
+    def get_versions(self, user_id, account_id=None):
+        """{account_id: version} for the user's accounts (or just one), read uncached.
+        
+        accounts.version moves on every update of the row, so this is all an
+        ETag check needs; the ledger tables are not touched.
+        """
         connection = self.db.get_connection()
         if connection:
             try:
                 cursor = connection.cursor(dictionary=True)
-                query = """
-                SELECT u.email, u.full_name, a.account_number, a.balance
-                FROM users u
-                JOIN accounts a ON u.user_id = a.user_id
-                WHERE a.account_id = %s
-                """
-                cursor.execute(query, (account_id,))
-                return cursor.fetchone()
+                if account_id is None:
+                    cursor.execute("SELECT account_id, version FROM accounts WHERE user_id = %s", (user_id,))
+                else:
+                    cursor.execute("SELECT account_id, version FROM accounts WHERE account_id = %s AND user_id = %s",
+                                   (account_id, user_id))
+                return {row['account_id']: row['version'] for row in cursor.fetchall()}
             except Error as e:
-                print(f"Error fetching user by account ID: {e}")
+                print(f"Error fetching account versions: {e}")
                 return None
             finally:
                 cursor.close()
                 connection.close()
-
-class Transaction:
-    def __init__(self, db):
-        self.db = db
-        self.email_service = EmailService()
     
-    def deposit(self, account_id, amount, description=""):
+    def resolve_account_numbers(self, account_numbers):
+        """{account_number: {account_id, account_number, status}} for the numbers that exist, in one query"""
+        account_numbers = list(set(account_numbers))
+        if not account_numbers:
+            return {}
+        connection = self.db.get_connection(read_only=True)
+        if connection:
+            try:
+                cursor = connection.cursor(dictionary=True)
+                placeholders = ', '.join(['%s'] * len(account_numbers))
+                cursor.execute(f"""
+                    SELECT account_id, account_number, status FROM accounts
+                    WHERE account_number IN ({placeholders})
+                """, account_numbers)
+                return {row['account_number']: row for row in cursor.fetchall()}
+            finally:
+                cursor.close()
+                connection.close()
+        raise Error(msg="Database unavailable")
+    
+    def get_owned_account(self, user_id, account_id, cached=True):
+        """The account if it belongs to the user, else None.
+        
+        Answered from the user's cached account list when there is one,
+        otherwise by a single primary-key lookup that is cached per account.
+        """
+        if cached:
+            accounts = self.db.account_cache.get(('accounts', user_id))
+            if accounts is not None:
+                account = next((a for a in accounts if a['account_id'] == account_id), None)
+                return dict(account) if account else None
+        
+        key = ('owned', user_id, account_id)
+        account = self.db.account_cache.get(key) if cached else None
+        if account is not None:
+            return dict(account)
+        generation = self.db.account_cache.generation()
         connection = self.db.get_connection()
         if connection:
             try:
                 cursor = connection.cursor(dictionary=True)
-                
-                # Get current account balance and user info for email
-                user_query = """
-                SELECT u.email, u.full_name, a.account_number, a.balance
-                FROM users u
-                JOIN accounts a ON u.user_id = a.user_id
-                WHERE a.account_id = %s
-                """
-                cursor.execute(user_query, (account_id,))
-                user_info = cursor.fetchone()
-                
-                if not user_info:
-                    return False, "Account not found"
-                
-                # Update account balance
-                update_query = "UPDATE accounts SET balance = balance + %s WHERE account_id = %s"
-                cursor.execute(update_query, (amount, account_id))
-                
-                # Record transaction
-                transaction_query = """
-                INSERT INTO transactions (to_account_id, amount, transaction_type, description)
-                VALUES (%s, %s, 'deposit', %s)
-                """
-                cursor.execute(transaction_query, (account_id, amount, description))
-                
-                connection.commit()
-                
-                # Send email notification
-                new_balance = float(user_info['balance']) + amount
-                try:
-                    self.email_service.send_transaction_notification(
-                        user_email=user_info['email'],
-                        user_name=user_info['full_name'],
-                        transaction_type='deposit',
-                        amount=amount,
-                        account_number=user_info['account_number'],
-                        balance=new_balance,
-                        description=description
-                    )
-                except Exception as e:
-                    print(f"Error sending deposit email notification: {e}")
-                
-                return True, "Deposit successful"
+                query = "SELECT * FROM accounts WHERE account_id = %s AND user_id = %s"
+                cursor.execute(query, (account_id, user_id))
+                row = cursor.fetchone()
             except Error as e:
-                print(f"Error processing deposit: {e}")
-                connection.rollback()
-                return False, str(e)
+                print(f"Error checking account ownership: {e}")
+                return None
             finally:
                 cursor.close()
                 connection.close()
+            
+            if not row:
+                return None
+            try:
+                named = self._with_branch_names([row])
+            except Error as e:
+                print(f"Error fetching branches: {e}")
+                return None
+            if not named:
+                return None
+            self.db.account_cache.set(key, named[0], tags=[('account', account_id)], generation=generation)
+            return dict(named[0])
     
-    def withdraw(self, account_id, amount, description=""):
-        connection = self.db.get_connection()
+    def get_balance_as_of(self, account_id, as_of):
+        """Balance just before ``as_of`` (a datetime): the latest daily snapshot plus the movement since.
+        
+        Both parts are index range scans (the snapshot primary key and
+        idx_transactions_from_date / idx_transactions_to_date), so the cost
+        does not grow with the length of the history; before an account's
+        first snapshot the movement is read from its created_at. Returns
+        ``{'balance', 'snapshot_date'}`` or None on error.
+        """
+        connection = self.db.get_connection(read_only=True)
         if connection:
             try:
                 cursor = connection.cursor(dictionary=True)
-                
-                # Get user info and check if account has sufficient balance
-                user_query = """
-                SELECT u.email, u.full_name, a.account_number, a.balance
-                FROM users u
-                JOIN accounts a ON u.user_id = a.user_id
-                WHERE a.account_id = %s
-                """
-                cursor.execute(user_query, (account_id,))
-                user_info = cursor.fetchone()
-                
-                if not user_info:
-                    return False, "Account not found"
-                
-                account_balance = float(user_info['balance'])
-                if account_balance < amount:
-                    return False, "Insufficient balance"
-                
-                # Update account balance
-                update_query = "UPDATE accounts SET balance = balance - %s WHERE account_id = %s"
-                cursor.execute(update_query, (amount, account_id))
-                
-                # Record transaction
-                transaction_query = """
-                INSERT INTO transactions (from_account_id, amount, transaction_type, description)
-                VALUES (%s, %s, 'withdrawal', %s)
-                """
-                cursor.execute(transaction_query, (account_id, amount, description))
-                
-                connection.commit()
-                
-                # Send email notification
-                new_balance = account_balance - amount
-                try:
-                    self.email_service.send_transaction_notification(
-                        user_email=user_info['email'],
-                        user_name=user_info['full_name'],
-                        transaction_type='withdrawal',
-                        amount=amount,
-                        account_number=user_info['account_number'],
-                        balance=new_balance,
-                        description=description
-                    )
-                except Exception as e:
-                    print(f"Error sending withdrawal email notification: {e}")
-                
-                return True, "Withdrawal successful"
+                cursor.execute("""
+                    SELECT balance_date, closing_balance FROM account_daily_balances
+                    WHERE account_id = %s AND balance_date < %s
+                    ORDER BY balance_date DESC
+                    LIMIT 1
+                """, (account_id, as_of.date()))
+                snapshot = cursor.fetchone()
+                if snapshot:
+                    snapshot_date = snapshot['balance_date']
+                    if isinstance(snapshot_date, str):
+                        snapshot_date = date.fromisoformat(snapshot_date)
+                    since = datetime.combine(snapshot_date + timedelta(days=1), datetime.min.time())
+                    opening = Decimal(str(snapshot['closing_balance']))
+                else:
+                    # No snapshot yet: accounts open at zero, so replay from the account's creation
+                    cursor.execute("SELECT created_at FROM accounts WHERE account_id = %s", (account_id,))
+                    account = cursor.fetchone()
+                    snapshot_date = None
+                    since = account['created_at'] if account else as_of
+                    if isinstance(since, str):
+                        since = datetime.fromisoformat(since)
+                    opening = Decimal('0')
+                cursor.execute("""
+                    SELECT
+                        (SELECT COALESCE(SUM(amount), 0) FROM transactions
+                         WHERE to_account_id = %s AND transaction_date >= %s AND transaction_date < %s)
+                      - (SELECT COALESCE(SUM(amount), 0) FROM transactions
+                         WHERE from_account_id = %s AND transaction_date >= %s AND transaction_date < %s) AS delta
+                """, (account_id, since, as_of, account_id, since, as_of))
+                delta = Decimal(str(cursor.fetchone()['delta']))
+                return {'balance': opening + delta, 'snapshot_date': snapshot_date}
             except Error as e:
-                print(f"Error processing withdrawal: {e}")
-                connection.rollback()
-                return False, str(e)
+                print(f"Error fetching balance as of {as_of}: {e}")
+                return None
             finally:
                 cursor.close()
                 connection.close()
     
-    def transfer(self, from_account_id, to_account_number, amount, description=""):
+    def _with_branch_names(self, accounts):
+        """Fill in branch_name from the reference-data cache instead of a join"""
+        named = []
+        for account in accounts:
+            branch = self.db.reference_data.branch(account['branch_id'])
+            if branch:
+                account['branch_name'] = branch['branch_name']
+                named.append(account)
+        return named
+    
+    def get_user_by_account_id(self, account_id):
+        """Get user information by account ID for email notifications"""
         connection = self.db.get_connection()
         if connection:
             try:
                 cursor = connection.cursor(dictionary=True)
-                
-                # Get sender user info and check if account has sufficient balance
-                sender_query = """
+                query = """
                 SELECT u.email, u.full_name, a.account_number, a.balance
                 FROM users u
                 JOIN accounts a ON u.user_id = a.user_id
                 WHERE a.account_id = %s
                 """
-                cursor.execute(sender_query, (from_account_id,))
-                sender_info = cursor.fetchone()
-                
-                if not sender_info:
-                    return False, "Sender account not found"
-                
-                sender_balance = float(sender_info['balance'])
-                if sender_balance < amount:
-                    return False, "Insufficient balance"
-                
-                # Get receiver account info
-                receiver_query = """
-                SELECT u.email, u.full_name, a.account_number, a.balance, a.account_id
-                FROM users u
-                JOIN accounts a ON u.user_id = a.user_id
-                WHERE a.account_number = %s
-                """
-                cursor.execute(receiver_query, (to_account_number,))
-                receiver_info = cursor.fetchone()
-                
-                if not receiver_info:
-                    return False, "Receiver account not found"
-                
-                to_account_id = receiver_info['account_id']
-                
-                # Update balances
-                update_sender = "UPDATE accounts SET balance = balance - %s WHERE account_id = %s"
-                cursor.execute(update_sender, (amount, from_account_id))
-                
-                update_receiver = "UPDATE accounts SET balance = balance + %s WHERE account_id = %s"
-                cursor.execute(update_receiver, (amount, to_account_id))
-                
-                # Record transaction
-                transaction_query = """
-                INSERT INTO transactions (from_account_id, to_account_id, amount, transaction_type, description)
-                VALUES (%s, %s, %s, 'transfer', %s)
-                """
-                cursor.execute(transaction_query, (from_account_id, to_account_id, amount, description))
-                
-                connection.commit()
-                
-                # Send email notifications
-                sender_new_balance = sender_balance - amount
-                receiver_new_balance = float(receiver_info['balance']) + amount
-                
-                # Email notification for sender
-                try:
-                    self.email_service.send_transaction_notification(
-                        user_email=sender_info['email'],
-                        user_name=sender_info['full_name'],
-                        transaction_type='transfer',
-                        amount=amount,
-                        account_number=sender_info['account_number'],
-                        balance=sender_new_balance,
-                        description=description
-                    )
-                except Exception as e:
-                    print(f"Error sending transfer email notification to sender: {e}")
-                
-                # Email notification for receiver (deposit notification)
-                try:
-                    self.email_service.send_transaction_notification(
-                        user_email=receiver_info['email'],
-                        user_name=receiver_info['full_name'],
-                        transaction_type='deposit',  # For receiver, it's a deposit
-                        amount=amount,
-                        account_number=receiver_info['account_number'],
-                        balance=receiver_new_balance,
-                        description=f"Transfer received from {sender_info['account_number']}: {description}"
-                    )
-                except Exception as e:
-                    print(f"Error sending transfer email notification to receiver: {e}")
-                
-                return True, "Transfer successful"
+                cursor.execute(query, (account_id,))
+                return cursor.fetchone()
             except Error as e:
-                print(f"Error processing transfer: {e}")
-                connection.rollback()
-                return False, str(e)
+                print(f"Error fetching user by account ID: {e}")
+                return None
             finally:
                 cursor.close()
                 connection.close()
+
+def encode_page_token(row):
+    """Opaque keyset cursor pointing just past ``row`` in newest-first history order"""
+    key = f"{row['transaction_date'].isoformat()}|{row['transaction_id']}"
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip('=')
+
+def decode_page_token(token):
+    """``(transaction_date, transaction_id)`` from a page token, or None if it is malformed"""
+    try:
+        key = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        transaction_date, transaction_id = key.split('|')
+        return datetime.fromisoformat(transaction_date), int(transaction_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+# Status codes returned by the transfer_funds stored procedure
+TRANSFER_PROCEDURE_ERRORS = {
+    'receiver_not_found': "Receiver account not found",
+    'sender_not_found': "Sender account not found",
+    'insufficient_balance': "Insufficient balance",
+}
+
+QUEUE_NOTIFICATION_QUERY = """
+INSERT INTO notification_outbox
+    (account_id, sender_account_id, transaction_type, amount, description,
+     user_email, user_name, account_number, balance)
+SELECT a.account_id, %s, %s, %s, %s, u.email, u.full_name, a.account_number, a.balance
+FROM accounts a
+JOIN users u ON u.user_id = a.user_id
+WHERE a.account_id = %s
+"""
+
+# Accounts per set-based balance UPDATE (three parameters each)
+BALANCE_UPDATE_BATCH = 1000
+
+
+def add_to_accounts(cursor, column, deltas, also_set='', set_params=(), guard='', guard_params=()):
+    """Add each account's delta to ``column``, BALANCE_UPDATE_BATCH accounts per statement.
+    
+    ``also_set`` is appended to the SET list and ``guard`` to the WHERE clause
+    of every statement, with ``set_params`` and ``guard_params`` for their
+    placeholders.
+    """
+    account_ids = sorted(deltas)
+    for start in range(0, len(account_ids), BALANCE_UPDATE_BATCH):
+        batch = account_ids[start:start + BALANCE_UPDATE_BATCH]
+        cases = ' '.join(['WHEN %s THEN %s'] * len(batch))
+        placeholders = ', '.join(['%s'] * len(batch))
+        params = ([value for account_id in batch for value in (account_id, deltas[account_id])]
+                  + list(set_params) + batch + list(guard_params))
+        cursor.execute(f"""
+            UPDATE accounts SET {column} = {column} + CASE account_id {cases} END{also_set}
+            WHERE account_id IN ({placeholders}){guard}
+        """, params)
+
+# post_entries messages as a transfer reports them
+TRANSFER_BATCH_ERRORS = {
+    "Account not found": "Sender account not found",
+}
+
+
+def _rolled_back(results):
+    """An atomic batch's results once one entry failed: the others report the rollback"""
+    return [(False, "Batch rolled back") if success else (success, message) for success, message in results]
+
+
+class Transaction:
+    def __init__(self, db, max_retries=None):
+        self.db = db
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv('TRANSFER_MAX_RETRIES', 5))
+        self.retry_backoff = float(os.getenv('TRANSFER_RETRY_BACKOFF', 0.02))
+        # The transfer_funds procedure (tables.sql) only exists on MySQL
+        self.use_procedure = db.backend.name == 'mysql' and os.getenv('TRANSFER_USE_PROCEDURE', '0') == '1'
+        self._stats_lock = threading.Lock()
+        self._lock_stats = {
+            'lock_acquisitions': 0,
+            'lock_wait_time': 0.0,
+            'deadlocks': 0,
+            'lock_wait_timeouts': 0,
+            'retries': 0,
+            'retries_exhausted': 0,
+        }
+    
+    def lock_stats(self):
+        """Row-lock wait and deadlock-retry counters of the money-movement paths"""
+        with self._stats_lock:
+            stats = dict(self._lock_stats)
+        stats['lock_wait_time'] = round(stats['lock_wait_time'], 6)
+        return stats
+    
+    def _count(self, key, value=1):
+        with self._stats_lock:
+            self._lock_stats[key] += value
+    
+    def _lock_accounts(self, cursor, account_ids):
+        """Lock the given account rows, always in ascending account_id order.
+        
+        Every writer takes its locks in the same order, so two opposing
+        transfers between the same accounts queue up instead of deadlocking.
+        """
+        account_ids = sorted(set(int(account_id) for account_id in account_ids))
+        placeholders = ', '.join(['%s'] * len(account_ids))
+        query = f"""
+        SELECT account_id, account_number, balance
+        FROM accounts
+        WHERE account_id IN ({placeholders})
+        ORDER BY account_id FOR UPDATE
+        """
+        rows = self._timed(cursor, query, account_ids).fetchall()
+        return {row['account_id']: row for row in rows}
+    
+    def _timed(self, cursor, query, params):
+        # Statements that take row locks; time spent in them is lock wait plus work
+        started = time.monotonic()
+        cursor.execute(query, params)
+        with self._stats_lock:
+            self._lock_stats['lock_acquisitions'] += 1
+            self._lock_stats['lock_wait_time'] += time.monotonic() - started
+        return cursor
+    
+    def _debit(self, cursor, account_id, amount):
+        """Sufficiency check and debit in one statement; False if nothing was debited"""
+        query = "UPDATE accounts SET balance = balance - %s WHERE account_id = %s AND balance >= %s"
+        return self._timed(cursor, query, (amount, account_id, amount)).rowcount == 1
+    
+    def _credit(self, cursor, account_id, amount):
+        query = "UPDATE accounts SET balance = balance + %s WHERE account_id = %s"
+        return self._timed(cursor, query, (amount, account_id)).rowcount == 1
+    
+    def _debit_failure(self, cursor, account_id, not_found_message):
+        # Only failed debits pay for this lookup, to tell the two causes apart
+        cursor.execute("SELECT 1 AS found FROM accounts WHERE account_id = %s", (account_id,))
+        if cursor.fetchone():
+            return False, "Insufficient balance"
+        return False, not_found_message
+    
+    def _should_retry(self, e, attempt):
+        """Count a failed attempt and, for deadlocks and lock wait timeouts, back off before retrying"""
+        if e.errno == ER_LOCK_DEADLOCK:
+            self._count('deadlocks')
+        elif e.errno == ER_LOCK_WAIT_TIMEOUT:
+            self._count('lock_wait_timeouts')
+        else:
+            return False
+        if attempt == self.max_retries:
+            self._count('retries_exhausted')
+            return False
+        self._count('retries')
+        # Exponential backoff with full jitter
+        time.sleep(random.uniform(0, self.retry_backoff * (2 ** attempt)))
+        return True
+    
+    def _run_with_retry(self, work, label, account_ids=()):
+        """Run ``work(cursor)`` in a transaction, retrying deadlocks and lock wait timeouts.
+        
+        ``work`` returns ``(success, message)``; the transaction is committed on
+        success and rolled back otherwise. Cached account lists holding
+        ``account_ids`` are dropped after a commit.
+        """
+        connection = self.db.get_connection()
+        if not connection:
+            return False, "Database unavailable"
+        try:
+            for attempt in range(self.max_retries + 1):
+                cursor = connection.cursor(dictionary=True)
+                try:
+                    success, message = work(cursor)
+                    if success:
+                        connection.commit()
+                        self._invalidate_accounts(account_ids)
+                    else:
+                        connection.rollback()
+                    return success, message
+                except Error as e:
+                    connection.rollback()
+                    if not self._should_retry(e, attempt):
+                        raise
+                finally:
+                    cursor.close()
+        except Error as e:
+            print(f"Error processing {label}: {e}")
+            return False, str(e)
+        finally:
+            connection.close()
+    
+    def _invalidate_accounts(self, account_ids):
+        for account_id in account_ids:
+            self.db.account_cache.invalidate_tag(('account', account_id))
+    
+    def _queue_notification(self, cursor, account_id, transaction_type, amount, description, sender_account_id=None):
+        """Write an email notification to the outbox, inside the ledger transaction.
+        
+        The owner, account number and post-update balance are copied by the
+        INSERT ... SELECT itself; notification_dispatcher.py sends it later, so
+        the request never waits on the email provider.
+        """
+        cursor.execute(QUEUE_NOTIFICATION_QUERY, (sender_account_id, transaction_type, amount, description, account_id))
+    
+    def deposit(self, account_id, amount, description=""):
+        if amount <= 0:
+            return False, "Amount must be positive"
+        account_id = int(account_id)
+        
+        def work(cursor):
+            if not self._credit(cursor, account_id, amount):
+                return False, "Account not found"
+            
+            # Record transaction
+            transaction_query = """
+            INSERT INTO transactions (to_account_id, amount, transaction_type, description)
+            VALUES (%s, %s, 'deposit', %s)
+            """
+            cursor.execute(transaction_query, (account_id, amount, description))
+            self._queue_notification(cursor, account_id, 'deposit', amount, description)
+            return True, "Deposit successful"
+        
+        return self._run_with_retry(work, 'deposit', account_ids=(account_id,))
+    
+    def withdraw(self, account_id, amount, description=""):
+        if amount <= 0:
+            return False, "Amount must be positive"
+        account_id = int(account_id)
+        
+        def work(cursor):
+            # The balance check is part of the UPDATE, so concurrent withdrawals cannot overdraw
+            if not self._debit(cursor, account_id, amount):
+                return self._debit_failure(cursor, account_id, "Account not found")
+            
+            # Record transaction
+            transaction_query = """
+            INSERT INTO transactions (from_account_id, amount, transaction_type, description)
+            VALUES (%s, %s, 'withdrawal', %s)
+            """
+            cursor.execute(transaction_query, (account_id, amount, description))
+            self._queue_notification(cursor, account_id, 'withdrawal', amount, description)
+            return True, "Withdrawal successful"
+        
+        return self._run_with_retry(work, 'withdrawal', account_ids=(account_id,))
     
-    def get_transactions(self, account_id, limit=10):
+    def transfer(self, from_account_id, to_account_number, amount, description=""):
+        if amount <= 0:
+            return False, "Amount must be positive"
+        if not is_valid_account_number(to_account_number):
+            return False, "Invalid receiver account number"
+        from_account_id = int(from_account_id)
+        
+        # Resolved from the in-memory directory; account ids never change so no lock is needed
+        try:
+            receiver = self.db.account_directory.resolve(to_account_number)
+        except Error as e:
+            print(f"Error resolving receiver account: {e}")
+            return False, "Database unavailable"
+        if not receiver:
+            return False, "Receiver account not found"
+        if receiver['status'] != 'active':
+            return False, "Receiver account is not active"
+        
+        if self.use_procedure:
+            return self._transfer_procedure(from_account_id, receiver['account_id'], to_account_number, amount, description)
+        to_account_id = receiver['account_id']
+        return self._run_with_retry(
+            lambda cursor: self._transfer_work(cursor, from_account_id, to_account_id, amount, description),
+            'transfer',
+            account_ids=(from_account_id, to_account_id)
+        )
+    
+    def _transfer_work(self, cursor, from_account_id, to_account_id, amount, description):
+        # Touch the rows in ascending account_id order so opposing transfers cannot deadlock
+        if to_account_id < from_account_id:
+            self._credit(cursor, to_account_id, amount)
+        if not self._debit(cursor, from_account_id, amount):
+            return self._debit_failure(cursor, from_account_id, "Sender account not found")
+        if to_account_id >= from_account_id:
+            self._credit(cursor, to_account_id, amount)
+        
+        # Record transaction
+        transaction_query = """
+        INSERT INTO transactions (from_account_id, to_account_id, amount, transaction_type, description)
+        VALUES (%s, %s, %s, 'transfer', %s)
+        """
+        cursor.execute(transaction_query, (from_account_id, to_account_id, amount, description))
+        
+        # Email notification for sender, and a deposit notification for the receiver
+        self._queue_notification(cursor, from_account_id, 'transfer', amount, description)
+        self._queue_notification(cursor, to_account_id, 'deposit', amount, description, sender_account_id=from_account_id)
+        return True, "Transfer successful"
+    
+    def _transfer_procedure(self, from_account_id, to_account_id, to_account_number, amount, description):
+        """Run the whole transfer server-side with the transfer_funds stored procedure.
+        
+        The procedure resolves the receiver, applies both conditional updates in
+        account_id order, records the transaction, queues the notifications and
+        commits, so no client round trip happens while row locks are held.
+        """
+        connection = self.db.get_connection()
+        if not connection:
+            return False, "Database unavailable"
+        try:
+            for attempt in range(self.max_retries + 1):
+                cursor = connection.cursor()
+                try:
+                    result = cursor.callproc('transfer_funds', (from_account_id, to_account_number, amount, description, None))
+                    status = result[4]
+                    break
+                except Error as e:
+                    if not self._should_retry(e, attempt):
+                        raise
+                finally:
+                    cursor.close()
+        except Error as e:
+            print(f"Error processing transfer: {e}")
+            return False, str(e)
+        finally:
+            connection.close()
+        
+        if status != 'ok':
+            return False, TRANSFER_PROCEDURE_ERRORS.get(status, status)
+        self._invalidate_accounts((from_account_id, to_account_id))
+        return True, "Transfer successful"
+    
+    def post_entries(self, entries, atomic=False, notify=True, label='batch posting'):
+        """Apply many ledger entries in one database transaction.
+        
+        Each entry is a dict with ``debit`` and ``credit`` account ids (either
+        may be None), ``amount`` (Decimal), ``transaction_type`` and
+        ``description``. All touched accounts are locked once, in account_id
+        order; entries are checked in order against the running balances, so
+        a debit only succeeds if the account still covers it. The net change
+        per account is then written with one set-based UPDATE and the
+        transaction and outbox rows with executemany.
+        
+        Returns one ``(success, message)`` per entry. With ``atomic`` a single
+        failed entry rolls back the whole batch.
+        """
+        if not entries:
+            return []
+        account_ids = {account_id for entry in entries for account_id in (entry['debit'], entry['credit'])
+                       if account_id is not None}
+        success, results = self._run_with_retry(
+            lambda cursor: self._post_entries_work(cursor, entries, atomic, notify),
+            label,
+            account_ids=account_ids
+        )
+        if isinstance(results, str):
+            # Database error: nothing was applied
+            return [(False, results)] * len(entries)
+        return results
+    
+    def _post_entries_work(self, cursor, entries, atomic, notify):
+        account_ids = {account_id for entry in entries for account_id in (entry['debit'], entry['credit'])
+                       if account_id is not None}
+        locked = self._lock_accounts(cursor, account_ids)
+        balances = {account_id: Decimal(str(row['balance'])) for account_id, row in locked.items()}
+        results = []
+        accepted = []
+        for entry in entries:
+            debit, credit, amount = entry['debit'], entry['credit'], entry['amount']
+            if amount <= 0:
+                results.append((False, "Amount must be positive"))
+            elif (debit is not None and debit not in balances) or (credit is not None and credit not in balances):
+                results.append((False, "Account not found"))
+            elif debit is not None and balances[debit] < amount:
+                results.append((False, "Insufficient balance"))
+            else:
+                if debit is not None:
+                    balances[debit] -= amount
+                if credit is not None:
+                    balances[credit] += amount
+                results.append((True, "Posted"))
+                accepted.append(entry)
+        
+        if atomic and len(accepted) < len(entries):
+            return False, _rolled_back(results)
+        
+        deltas = {account_id: balance - Decimal(str(locked[account_id]['balance']))
+                  for account_id, balance in balances.items()}
+        self._apply_deltas(cursor, deltas)
+        if accepted:
+            cursor.executemany("""
+                INSERT INTO transactions (from_account_id, to_account_id, amount, transaction_type, description)
+                VALUES (%s, %s, %s, %s, %s)
+            """, [(e['debit'], e['credit'], e['amount'], e['transaction_type'], e['description']) for e in accepted])
+            if notify:
+                cursor.executemany(QUEUE_NOTIFICATION_QUERY, self._entry_notifications(accepted))
+        return True, results
+    
+    def transfer_batch(self, transfers, atomic=True):
+        """Run many transfers in one database transaction.
+        
+        ``transfers`` are dicts with ``from_account_id``, ``to_account_number``,
+        ``amount`` (Decimal) and optionally ``description``. All receivers are
+        resolved with one IN (...) query, then the transfers are posted like
+        post_entries: sorted row locks, one set-based balance UPDATE and
+        executemany inserts.
+        
+        Returns one ``(success, message)`` per transfer. With ``atomic`` (the
+        default) either every transfer is applied or none is; otherwise each
+        one succeeds or fails on its own.
+        """
+        if not transfers:
+            return []
+        numbers = {t['to_account_number'] for t in transfers if is_valid_account_number(t['to_account_number'])}
+        touched = set()
+        
+        def work(cursor):
+            receivers = {}
+            if numbers:
+                placeholders = ', '.join(['%s'] * len(numbers))
+                cursor.execute(f"""
+                    SELECT account_id, account_number, status FROM accounts
+                    WHERE account_number IN ({placeholders})
+                """, list(numbers))
+                receivers = {row['account_number']: row for row in cursor.fetchall()}
+            
+            results = []
+            entries = []
+            for t in transfers:
+                receiver = receivers.get(t['to_account_number'])
+                if t['amount'] <= 0:
+                    results.append((False, "Amount must be positive"))
+                elif t['to_account_number'] not in numbers:
+                    results.append((False, "Invalid receiver account number"))
+                elif receiver is None or receiver['status'] != 'active':
+                    results.append((False, "Receiver account not found"))
+                else:
+                    results.append(None)
+                    entries.append({'debit': int(t['from_account_id']), 'credit': receiver['account_id'],
+                                    'amount': t['amount'], 'transaction_type': 'transfer',
+                                    'description': t.get('description') or ''})
+            if atomic and len(entries) < len(transfers):
+                return False, _rolled_back([result or (True, "") for result in results])
+            
+            success, posted = self._post_entries_work(cursor, entries, atomic, notify=True) if entries else (True, [])
+            touched.update(account_id for entry in entries for account_id in (entry['debit'], entry['credit']))
+            posted = iter(posted)
+            merged = []
+            for result in results:
+                if result is None:
+                    ok, message = next(posted)
+                    result = (True, "Transfer successful") if ok else (False, TRANSFER_BATCH_ERRORS.get(message, message))
+                merged.append(result)
+            return success, merged
+        
+        success, results = self._run_with_retry(work, 'batch transfer')
+        if isinstance(results, str):
+            return [(False, results)] * len(transfers)
+        if success:
+            self._invalidate_accounts(touched)
+        return results
+    
+    def _apply_deltas(self, cursor, deltas):
+        """Add each account's net change to its balance"""
+        add_to_accounts(cursor, 'balance', {account_id: delta for account_id, delta in deltas.items() if delta != 0})
+    
+    def _entry_notifications(self, entries):
+        rows = []
+        for e in entries:
+            if e['transaction_type'] == 'transfer':
+                rows.append((None, 'transfer', e['amount'], e['description'], e['debit']))
+                rows.append((e['debit'], 'deposit', e['amount'], e['description'], e['credit']))
+            elif e['credit'] is not None:
+                rows.append((None, 'deposit', e['amount'], e['description'], e['credit']))
+            else:
+                rows.append((None, 'withdrawal', e['amount'], e['description'], e['debit']))
+        return rows
+    
+    def get_transactions(self, account_id, limit=10, before=None):
+        """Newest ``limit`` transactions touching the account.
+        
+        Each side of the history is read as its own index range scan
+        (idx_transactions_from_date / idx_transactions_to_date) capped at
+        ``limit`` rows, and the two short lists are merged, instead of an OR
+        filter that scans and filesorts the whole table. ``before`` is a
+        ``(transaction_date, transaction_id)`` key: only older rows are
+        returned, so deeper pages cost the same as the first one.
+        """
         connection = self.db.get_connection()
         if connection:
             try:
                 cursor = connection.cursor(dictionary=True)
-                query = """
+                keyset = ""
+                keyset_params = ()
+                if before:
+                    keyset = "AND (transaction_date < %s OR (transaction_date = %s AND transaction_id < %s))"
+                    keyset_params = (before[0], before[0], before[1])
+                query = f"""
                 SELECT t.*, 
                        fa.account_number as from_account_number,
                        ta.account_number as to_account_number
-                FROM transactions t
+                FROM (
+                    SELECT * FROM (
+                        SELECT * FROM transactions
+                        WHERE from_account_id = %s {keyset}
+                        ORDER BY transaction_date DESC, transaction_id DESC
+                        LIMIT %s
+                    ) AS sent
+                    UNION ALL
+                    SELECT * FROM (
+                        SELECT * FROM transactions
+                        WHERE to_account_id = %s AND (from_account_id IS NULL OR from_account_id <> %s) {keyset}
+                        ORDER BY transaction_date DESC, transaction_id DESC
+                        LIMIT %s
+                    ) AS received
+                ) AS t
                 LEFT JOIN accounts fa ON t.from_account_id = fa.account_id
                 LEFT JOIN accounts ta ON t.to_account_id = ta.account_id
-                WHERE t.from_account_id = %s OR t.to_account_id = %s
-                ORDER BY t.transaction_date DESC
+                ORDER BY t.transaction_date DESC, t.transaction_id DESC
                 LIMIT %s
                 """
-                cursor.execute(query, (account_id, account_id, limit))
+                params = (account_id,) + keyset_params + (limit, account_id, account_id) + keyset_params + (limit, limit)
+                cursor.execute(query, params)
                 return cursor.fetchall()
             except Error as e:
                 print(f"Error fetching transactions: {e}")
                 return []
             finally:
                 cursor.close()
-                connection.close()
\ No newline at end of file
+                connection.close()
+        return []
+    
+    def get_transactions_page(self, account_id, limit=10, page_token=None):
+        """One page of history plus the opaque token for the next page (None on the last page)"""
+        before = decode_page_token(page_token) if page_token else None
+        rows = self.get_transactions(account_id, limit + 1, before)
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, encode_page_token(rows[-1])
+    
+    def iter_statement(self, account_id, start, end, batch_size=500):
+        """Generator over the account's transactions in [start, end), oldest first.
+        
+        Rows are pulled from an unbuffered cursor ``batch_size`` at a time, so
+        memory stays flat however long the statement is. The connection is
+        busy until the generator is exhausted or closed; one closed early is
+        discarded rather than read to the end.
+        """
+        connection = self.db.get_connection(read_only=True)
+        if not connection:
+            return
+        cursor = connection.cursor(dictionary=True, buffered=False)
+        exhausted = False
+        try:
+            query = """
+            SELECT t.transaction_id, t.transaction_date, t.transaction_type, t.amount, t.description,
+                   fa.account_number as from_account_number,
+                   ta.account_number as to_account_number
+            FROM (
+                SELECT * FROM transactions
+                WHERE from_account_id = %s AND transaction_date >= %s AND transaction_date < %s
+                UNION ALL
+                SELECT * FROM transactions
+                WHERE to_account_id = %s AND (from_account_id IS NULL OR from_account_id <> %s)
+                  AND transaction_date >= %s AND transaction_date < %s
+            ) AS t
+            LEFT JOIN accounts fa ON t.from_account_id = fa.account_id
+            LEFT JOIN accounts ta ON t.to_account_id = ta.account_id
+            ORDER BY t.transaction_date, t.transaction_id
+            """
+            cursor.execute(query, (account_id, start, end, account_id, account_id, start, end))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    exhausted = True
+                    return
+                yield from rows
+        except Error as e:
+            print(f"Error streaming statement: {e}")
+        finally:
+            if exhausted:
+                cursor.close()
+                connection.close()
+            else:
+                # An abandoned download leaves unread rows that would block the
+                # connection; dropping it is cheaper than reading them all
+                connection.discard()
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Drains the notification_outbox table and sends the emails.
+
+Money-movement code only writes outbox rows (in the same transaction as the
+ledger change); this process delivers them, so request latency does not
+depend on the email provider. Run it next to the web app:
+
+    python notification_dispatcher.py            # poll forever
+    python notification_dispatcher.py --once     # drain what is due and exit
+
+Several dispatchers can run at once: rows are claimed with
+SELECT ... FOR UPDATE SKIP LOCKED and leased for --lease seconds, so a crashed
+dispatcher's rows are picked up again once the lease runs out.
+
+Due notifications are coalesced into multi-message Mailjet calls of up to
+--email-batch-size messages. A partial batch is held back until its oldest
+notification has waited --max-latency seconds, so quiet periods still send
+promptly while busy periods send few, large requests.
+"""
+
+import argparse
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from mysql.connector import Error
+from email_service import EmailService, MAX_MESSAGES_PER_CALL
+from model import Database
+
+
+class NotificationDispatcher:
+    def __init__(self, db, email_service=None, workers=4, batch_size=200, email_batch_size=50,
+                 max_latency=1.0, max_attempts=8, base_delay=30, max_delay=3600, lease_seconds=300):
+        self.db = db
+        self.email_service = email_service or EmailService()
+        self.workers = workers
+        self.batch_size = batch_size
+        self.email_batch_size = min(email_batch_size, MAX_MESSAGES_PER_CALL)
+        self.max_latency = max_latency
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lease_seconds = lease_seconds
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def _db_now(self, cursor):
+        # Use the database clock everywhere; rows default to CURRENT_TIMESTAMP
+        cursor.execute("SELECT CURRENT_TIMESTAMP AS now")
+        now = cursor.fetchone()['now']
+        return datetime.fromisoformat(now) if isinstance(now, str) else now
+
+    def claim(self):
+        """Lease up to batch_size due notifications to this dispatcher"""
+        connection = self.db.checkout()
+        if not connection:
+            return []
+        try:
+            cursor = connection.cursor(dictionary=True)
+            now = self._db_now(cursor)
+            # 'sending' rows whose lease expired belong to a dispatcher that died mid-send
+            cursor.execute("""
+                SELECT notification_id, status, attempts, next_attempt_at FROM notification_outbox
+                WHERE status IN ('pending', 'sending') AND next_attempt_at <= %s
+                ORDER BY next_attempt_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            """, (now, self.batch_size))
+            due = cursor.fetchall()
+            # Hold back a partial email batch until its oldest row reaches max_latency
+            if not due or (len(due) < self.email_batch_size
+                           and (now - due[0]['next_attempt_at']).total_seconds() < self.max_latency):
+                connection.rollback()
+                return []
+            # An expired lease counts as a failed attempt, so a message that keeps
+            # killing its dispatcher is dead-lettered instead of retried forever
+            dead = [row['notification_id'] for row in due
+                    if row['status'] == 'sending' and row['attempts'] + 1 >= self.max_attempts]
+            if dead:
+                cursor.execute(f"""
+                    UPDATE notification_outbox
+                    SET status = 'dead', attempts = attempts + 1, last_error = 'Lease expired during send'
+                    WHERE notification_id IN ({', '.join(['%s'] * len(dead))})
+                """, dead)
+                print(f"⚠️ Dead-lettered {len(dead)} notification(s) whose sends never finished")
+            ids = [row['notification_id'] for row in due if row['notification_id'] not in dead]
+            if not ids:
+                connection.commit()
+                return []
+            placeholders = ', '.join(['%s'] * len(ids))
+            cursor.execute(f"""
+                UPDATE notification_outbox
+                SET attempts = attempts + CASE WHEN status = 'sending' THEN 1 ELSE 0 END,
+                    status = 'sending', next_attempt_at = %s
+                WHERE notification_id IN ({placeholders})
+            """, [now + timedelta(seconds=self.lease_seconds)] + ids)
+            connection.commit()
+
+            cursor.execute(f"""
+                SELECT n.*, s.account_number AS sender_account_number
+                FROM notification_outbox n
+                LEFT JOIN accounts s ON s.account_id = n.sender_account_id
+                WHERE n.notification_id IN ({placeholders})
+            """, ids)
+            rows = cursor.fetchall()
+            connection.commit()
+            cursor.close()
+            return rows
+        except Error as e:
+            print(f"Error claiming notifications: {e}")
+            connection.rollback()
+            return []
+        finally:
+            connection.close()
+
+    def build_message(self, notification):
+        description = notification['description'] or ''
+        if notification['sender_account_number']:
+            description = f"Transfer received from {notification['sender_account_number']}: {description}"
+        return self.email_service.build_transaction_message(
+            user_email=notification['user_email'],
+            user_name=notification['user_name'],
+            transaction_type=notification['transaction_type'],
+            amount=float(notification['amount']),
+            account_number=notification['account_number'],
+            balance=float(notification['balance']),
+            description=description
+        )
+
+    def deliver(self, notifications):
+        """Send notifications in one Mailjet call; returns None or an error per notification"""
+        try:
+            return self.email_service.send_messages([self.build_message(n) for n in notifications])
+        except Exception as e:
+            return [str(e)] * len(notifications)
+
+    def retry_delay(self, attempts):
+        """Exponential backoff with jitter, capped at max_delay"""
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempts - 1)))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def record_results(self, notifications, errors):
+        connection = self.db.checkout()
+        if not connection:
+            return
+        try:
+            cursor = connection.cursor(dictionary=True)
+            now = self._db_now(cursor)
+            sent = []
+            retries = []
+            dead = []
+            for notification, error in zip(notifications, errors):
+                attempts = notification['attempts'] + 1
+                if error is None:
+                    sent.append((attempts, now, notification['notification_id']))
+                elif attempts >= self.max_attempts:
+                    dead.append((attempts, error, notification['notification_id']))
+                else:
+                    next_attempt_at = now + timedelta(seconds=self.retry_delay(attempts))
+                    retries.append((attempts, error, next_attempt_at, notification['notification_id']))
+            if sent:
+                cursor.executemany("""
+                    UPDATE notification_outbox SET status = 'sent', attempts = %s, sent_at = %s, last_error = NULL
+                    WHERE notification_id = %s
+                """, sent)
+            if retries:
+                cursor.executemany("""
+                    UPDATE notification_outbox SET status = 'pending', attempts = %s, last_error = %s, next_attempt_at = %s
+                    WHERE notification_id = %s
+                """, retries)
+            if dead:
+                # Dead-lettered: kept for inspection, never retried automatically
+                cursor.executemany("""
+                    UPDATE notification_outbox SET status = 'dead', attempts = %s, last_error = %s
+                    WHERE notification_id = %s
+                """, dead)
+            connection.commit()
+            cursor.close()
+            if dead:
+                print(f"⚠️ Dead-lettered {len(dead)} notification(s) after {self.max_attempts} attempts")
+        except Error as e:
+            print(f"Error recording notification results: {e}")
+            connection.rollback()
+        finally:
+            connection.close()
+
+    def run_once(self):
+        """Claim, send and record one batch; returns how many notifications were processed"""
+        notifications = self.claim()
+        if not notifications:
+            return 0
+        batches = [notifications[start:start + self.email_batch_size]
+                   for start in range(0, len(notifications), self.email_batch_size)]
+        errors = []
+        for batch_errors in self._executor.map(self.deliver, batches):
+            errors.extend(batch_errors)
+        self.record_results(notifications, errors)
+        return len(notifications)
+
+    def run_forever(self, poll_interval=0.2):
+        print(f"Notification dispatcher running with {self.workers} worker(s)")
+        while True:
+            # Keep draining while there is a backlog, sleep only when idle
+            if self.run_once() < self.batch_size:
+                time.sleep(poll_interval)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Send queued transaction notification emails')
+    parser.add_argument('--once', action='store_true', help='drain due notifications and exit')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('DISPATCHER_WORKERS', 4)))
+    parser.add_argument('--batch-size', type=int, default=int(os.getenv('DISPATCHER_BATCH_SIZE', 200)),
+                        help='notifications claimed per cycle')
+    parser.add_argument('--email-batch-size', type=int, default=int(os.getenv('DISPATCHER_EMAIL_BATCH_SIZE', 50)),
+                        help='messages per Mailjet call (at most 50)')
+    parser.add_argument('--max-latency', type=float, default=float(os.getenv('DISPATCHER_MAX_LATENCY', 1.0)),
+                        help='seconds a partial email batch may wait to fill up')
+    parser.add_argument('--max-attempts', type=int, default=int(os.getenv('DISPATCHER_MAX_ATTEMPTS', 8)))
+    parser.add_argument('--lease', type=int, default=300, help='seconds before an unfinished claim is retried')
+    parser.add_argument('--interval', type=float, default=0.2, help='poll interval when idle, in seconds')
+    args = parser.parse_args()
+
+    dispatcher = NotificationDispatcher(
+        Database(),
+        workers=args.workers,
+        batch_size=args.batch_size,
+        email_batch_size=args.email_batch_size,
+        # --once drains everything that is due, partial batches included
+        max_latency=0 if args.once else args.max_latency,
+        max_attempts=args.max_attempts,
+        lease_seconds=args.lease
+    )
+    if args.once:
+        total = 0
+        while True:
+            processed = dispatcher.run_once()
+            total += processed
+            if processed < args.batch_size:
+                break
+        print(f"Processed {total} notification(s)")
+    else:
+        dispatcher.run_forever(args.interval)
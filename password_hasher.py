@@ -0,0 +1,119 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# Full werkzeug method spec, e.g. 'pbkdf2:sha256:600000' or 'scrypt:32768:8:1'
+PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+
+
+class HasherBusy(Exception):
+    """Raised when the hashing queue stays full for longer than the timeout"""
+
+
+def password_needs_rehash(password_hash, method=None):
+    """True if the hash was made with other parameters than ``method``"""
+    return password_hash.split('$', 1)[0] != (method or PASSWORD_HASH_METHOD)
+
+
+# Module-level so the worker processes can unpickle them
+def _hash(password, method):
+    return generate_password_hash(password, method=method)
+
+
+def _verify(password_hash, password):
+    return check_password_hash(password_hash, password)
+
+
+class PasswordHasher:
+    """Runs password hashing and verification in a pool of worker processes.
+
+    PBKDF2 holds the GIL for the whole computation, so doing it on the request
+    thread stalls every other request in the worker. At most ``workers +
+    queue_size`` operations are outstanding; further callers wait up to
+    ``timeout`` seconds and then get HasherBusy. ``workers=0`` hashes inline.
+    """
+
+    def __init__(self, workers=2, queue_size=64, timeout=5.0, method=None):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.method = method or PASSWORD_HASH_METHOD
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pending = 0
+        self._operations = 0
+        self._rejected = 0
+        self._hash_time = 0.0
+        self._max_hash_time = 0.0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            workers=int(os.getenv('PASSWORD_HASH_WORKERS', 2)),
+            queue_size=int(os.getenv('PASSWORD_HASH_QUEUE', 64)),
+            timeout=float(os.getenv('PASSWORD_HASH_TIMEOUT', 5))
+        )
+
+    def _get_executor(self):
+        # Spawned rather than forked: the web process has threads and open sockets
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context('spawn')
+                    )
+        return self._executor
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._rejected += 1
+            raise HasherBusy(f"Password hashing queue full for {self.timeout}s")
+        started = time.monotonic()
+        with self._lock:
+            self._pending += 1
+        try:
+            if self.workers == 0:
+                return fn(*args)
+            return self._get_executor().submit(fn, *args).result()
+        finally:
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self._pending -= 1
+                self._operations += 1
+                self._hash_time += elapsed
+                self._max_hash_time = max(self._max_hash_time, elapsed)
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(_verify, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        return password_needs_rehash(password_hash, self.method)
+
+    def stats(self):
+        """Snapshot of queue depth and hash latency (queue wait included)"""
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_size': self.queue_size,
+                'pending': self._pending,
+                'queued': max(0, self._pending - self.workers),
+                'operations': self._operations,
+                'rejected': self._rejected,
+                'avg_latency': round(self._hash_time / self._operations, 6) if self._operations else 0.0,
+                'max_latency': round(self._max_hash_time, 6),
+            }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
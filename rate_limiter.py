@@ -0,0 +1,124 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class SlidingWindowCounter:
+    """In-memory sliding-window hit counter.
+
+    Each key holds a ring of ``buckets`` counters covering ``window`` seconds,
+    so the count is exact to within one bucket width. Keys are kept in LRU
+    order and the least recently used are evicted beyond ``max_keys``, which
+    bounds memory when an attacker cycles through usernames.
+    """
+
+    def __init__(self, window=300, buckets=10, max_keys=100000):
+        self.window = window
+        self.buckets = buckets
+        self.bucket_width = window / buckets
+        self.max_keys = max_keys
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _advance(self, entry, bucket):
+        # entry is [last_bucket, counts]; zero the slots that slid out of the window
+        last, counts = entry
+        for b in range(max(last + 1, bucket - self.buckets + 1), bucket + 1):
+            counts[b % self.buckets] = 0
+        entry[0] = max(last, bucket)
+
+    def hit(self, key, now=None):
+        """Record a hit and return the number of hits in the window, this one included"""
+        bucket = int((time.time() if now is None else now) // self.bucket_width)
+        with self._lock:
+            entry = self._keys.get(key)
+            if entry is None:
+                entry = [bucket, [0] * self.buckets]
+                self._keys[key] = entry
+                if len(self._keys) > self.max_keys:
+                    self._keys.popitem(last=False)
+            else:
+                self._keys.move_to_end(key)
+                self._advance(entry, bucket)
+            entry[1][bucket % self.buckets] += 1
+            return sum(entry[1])
+
+    def reset(self, key):
+        with self._lock:
+            self._keys.pop(key, None)
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class RedisSlidingWindowCounter:
+    """Same counter kept in Redis, so several app workers share one limit"""
+
+    def __init__(self, client, window=300, buckets=10, prefix='ratelimit'):
+        self.client = client
+        self.window = window
+        self.buckets = buckets
+        self.bucket_width = window / buckets
+        self.prefix = prefix
+
+    def hit(self, key, now=None):
+        bucket = int((time.time() if now is None else now) // self.bucket_width)
+        keys = [f"{self.prefix}:{key}:{b}" for b in range(bucket - self.buckets + 1, bucket + 1)]
+        pipe = self.client.pipeline()
+        pipe.incr(keys[-1])
+        pipe.expire(keys[-1], int(self.window + self.bucket_width))
+        pipe.mget(keys[:-1])
+        current, _, older = pipe.execute()
+        return current + sum(int(count) for count in older if count)
+
+    def reset(self, key):
+        bucket = int(time.time() // self.bucket_width)
+        self.client.delete(*[f"{self.prefix}:{key}:{b}" for b in range(bucket - self.buckets + 1, bucket + 1)])
+
+
+class LoginRateLimiter:
+    """Throttles login attempts per username and per client IP.
+
+    Checked before the user lookup and password hash, so guesses over the
+    limit cost a dictionary update instead of a query and a PBKDF2 run.
+    """
+
+    def __init__(self, username_limit=5, ip_limit=20, window=300, buckets=10, redis_url=None):
+        self.username_limit = username_limit
+        self.ip_limit = ip_limit
+        self.window = window
+        if redis_url:
+            if redis is None:
+                raise RuntimeError("RATE_LIMIT_REDIS_URL is set but the redis package is not installed")
+            client = redis.Redis.from_url(redis_url)
+            self.usernames = RedisSlidingWindowCounter(client, window, buckets, prefix='login:user')
+            self.ips = RedisSlidingWindowCounter(client, window, buckets, prefix='login:ip')
+        else:
+            self.usernames = SlidingWindowCounter(window, buckets)
+            self.ips = SlidingWindowCounter(window, buckets)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            username_limit=int(os.getenv('LOGIN_LIMIT_USERNAME', 5)),
+            ip_limit=int(os.getenv('LOGIN_LIMIT_IP', 20)),
+            window=int(os.getenv('LOGIN_LIMIT_WINDOW', 300)),
+            redis_url=os.getenv('RATE_LIMIT_REDIS_URL')
+        )
+
+    def allow(self, username, ip):
+        """Count a login attempt; False if the username or the IP is over its limit"""
+        username = username.strip().lower()
+        over_ip = self.ips.hit(ip) > self.ip_limit
+        over_username = self.usernames.hit(username) > self.username_limit
+        return not (over_ip or over_username)
+
+    def succeeded(self, username):
+        """A correct password clears the username's failed attempts"""
+        self.usernames.reset(username.strip().lower())
@@ -0,0 +1,68 @@
+import os
+import threading
+import time
+from mysql.connector import Error
+
+
+class ReferenceData:
+    """In-memory copy of rarely changing tables (branches), kept in process.
+
+    Triggers bump reference_versions.version on every change to branches, so
+    staying current costs one primary-key read every ``check_interval``
+    seconds; the table itself is only reloaded when its version moves.
+    """
+
+    def __init__(self, db, check_interval=60.0):
+        self.db = db
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._branches = {}
+        self._version = None
+        self._checked_at = 0.0
+        self._loads = 0
+
+    @classmethod
+    def from_env(cls, db):
+        return cls(db, check_interval=float(os.getenv('REFERENCE_DATA_CHECK_INTERVAL', 60)))
+
+    def refresh(self, force=False):
+        """Reload branches if their version changed (or if ``force``)"""
+        if not force and self._version is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            connection = self.db.get_connection(read_only=True)
+            if not connection:
+                raise Error(msg="No database connection for reference data")
+            try:
+                cursor = connection.cursor(dictionary=True)
+                # Version first: a change landing in between only causes one extra reload
+                cursor.execute("SELECT version FROM reference_versions WHERE name = 'branches'")
+                row = cursor.fetchone()
+                version = row['version'] if row else None
+                if force or version is None or version != self._version:
+                    cursor.execute("SELECT * FROM branches ORDER BY branch_id")
+                    self._branches = {branch['branch_id']: branch for branch in cursor.fetchall()}
+                    self._version = version
+                    self._loads += 1
+                cursor.close()
+                self._checked_at = time.monotonic()
+            finally:
+                connection.close()
+
+    def branches(self):
+        """All branches, for the create-account form"""
+        self.refresh()
+        return [dict(branch) for branch in self._branches.values()]
+
+    def branch(self, branch_id):
+        """Branch row by id, or None; an unknown id triggers one version check"""
+        self.refresh()
+        branch = self._branches.get(branch_id)
+        if branch is None and branch_id is not None:
+            self._checked_at = 0.0
+            self.refresh()
+            branch = self._branches.get(branch_id)
+        return branch
+
+    def stats(self):
+        return {'branches': len(self._branches), 'version': self._version, 'loads': self._loads}
@@ -0,0 +1,26 @@
+"""JSON views of account and transaction rows, shared by the API, the web app and statements"""
+
+
+def account_json(account):
+    return {
+        'account_id': account['account_id'],
+        'account_number': account['account_number'],
+        'account_type': account['account_type'],
+        'balance': float(account['balance']),
+        'interest': float(account['interest']),
+        'status': account['status'],
+        'branch_name': account.get('branch_name'),
+        'version': account['version'],
+    }
+
+
+def transaction_json(transaction):
+    return {
+        'transaction_id': transaction['transaction_id'],
+        'transaction_type': transaction['transaction_type'],
+        'amount': float(transaction['amount']),
+        'description': transaction['description'],
+        'transaction_date': transaction['transaction_date'].isoformat(),
+        'from_account_number': transaction['from_account_number'],
+        'to_account_number': transaction['to_account_number'],
+    }
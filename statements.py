@@ -0,0 +1,44 @@
+import csv
+import io
+import json
+from serializers import transaction_json
+
+STATEMENT_FIELDS = ['transaction_id', 'transaction_date', 'transaction_type', 'amount', 'description',
+                    'from_account_number', 'to_account_number']
+
+# Rows per chunk handed to the WSGI server
+CHUNK_ROWS = 500
+
+
+def _csv_safe(value):
+    # Descriptions come from other users; keep spreadsheets from running them as formulas
+    if isinstance(value, str) and value[:1] in ('=', '+', '-', '@'):
+        return "'" + value
+    return value
+
+
+def csv_chunks(rows):
+    """Encode statement rows as CSV, yielding one string per CHUNK_ROWS rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(STATEMENT_FIELDS)
+    for count, row in enumerate(rows, 1):
+        record = transaction_json(row)
+        writer.writerow([_csv_safe(record[field]) for field in STATEMENT_FIELDS])
+        if count % CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def jsonl_chunks(rows):
+    """Encode statement rows as JSON Lines, yielding one string per CHUNK_ROWS rows"""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(transaction_json(row), separators=(',', ':')))
+        if len(lines) == CHUNK_ROWS:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
@@ -0,0 +1,312 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from decimal import Decimal
+from mysql.connector import errors
+from connection_pool import ConnectionPool
+
+# MySQL error codes worth retrying: deadlock victim and lock wait timeout
+ER_LOCK_DEADLOCK = 1213
+ER_LOCK_WAIT_TIMEOUT = 1205
+ER_DUP_ENTRY = 1062
+
+# SQLite has no row locks; a locking read takes the database write lock instead
+FOR_UPDATE = re.compile(r'\s+FOR UPDATE(\s+SKIP LOCKED)?\s*$', re.IGNORECASE)
+
+SQLITE_SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tables_sqlite.sql')
+
+CENT = Decimal('0.01')
+
+
+class MySQLBackend:
+    """MySQL storage served from a bounded ConnectionPool"""
+    name = 'mysql'
+
+    def __init__(self, host='localhost', user='root', password='123', database='banking_system',
+                 pool_size=10, pool_timeout=10.0, max_lifetime=1800, pool_name='banking_pool'):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.database = database
+        self.pool_size = pool_size
+        self.pool_timeout = pool_timeout
+        self.max_lifetime = max_lifetime
+        self.pool_name = pool_name
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, host=None, pool_name='banking_pool'):
+        return cls(
+            host=host or os.getenv('DB_HOST', 'localhost'),
+            user=os.getenv('DB_USER', 'root'),
+            password=os.getenv('DB_PASSWORD', '123'),
+            database=os.getenv('DB_NAME', 'banking_system'),
+            pool_size=int(os.getenv('DB_POOL_SIZE', 10)),
+            pool_timeout=float(os.getenv('DB_POOL_TIMEOUT', 10)),
+            max_lifetime=int(os.getenv('DB_POOL_MAX_LIFETIME', 1800)),
+            pool_name=pool_name
+        )
+
+    def _get_pool(self):
+        # Created lazily so importing the app does not need a reachable server
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ConnectionPool(
+                        pool_size=self.pool_size,
+                        timeout=self.pool_timeout,
+                        max_lifetime=self.max_lifetime,
+                        pool_name=self.pool_name,
+                        host=self.host,
+                        user=self.user,
+                        password=self.password,
+                        database=self.database
+                    )
+        return self._pool
+
+    def checkout(self):
+        return self._get_pool().get_connection()
+
+    def stats(self):
+        if self._pool is None:
+            return {'size': self.pool_size, 'in_use': 0, 'idle': 0, 'checkouts': 0, 'waits': 0,
+                    'wait_time': 0.0, 'timeouts': 0, 'recycled': 0, 'errors': 0}
+        return self._pool.stats()
+
+
+def _translate_error(e):
+    """Re-raise sqlite3 errors as the mysql.connector errors the models catch"""
+    message = str(e)
+    if isinstance(e, sqlite3.IntegrityError):
+        errno = ER_DUP_ENTRY if 'UNIQUE' in message else None
+        return errors.IntegrityError(msg=message, errno=errno)
+    if isinstance(e, sqlite3.OperationalError) and ('locked' in message or 'busy' in message):
+        return errors.DatabaseError(msg=message, errno=ER_LOCK_WAIT_TIMEOUT)
+    return errors.DatabaseError(msg=message)
+
+
+class SQLiteCursor:
+    """mysql.connector-style cursor over sqlite3: %s placeholders, dict rows.
+
+    ``SELECT ... FOR UPDATE`` is emulated by opening the transaction with
+    BEGIN IMMEDIATE, which serializes writers the way row locks would.
+    """
+
+    def __init__(self, cursor, dictionary=False):
+        self._cursor = cursor
+        self._dictionary = dictionary
+
+    def _row(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return dict(zip([column[0] for column in self._cursor.description], row))
+
+    def execute(self, query, params=()):
+        try:
+            locking_read = FOR_UPDATE.search(query)
+            if locking_read:
+                query = query[:locking_read.start()]
+                if not self._cursor.connection.in_transaction:
+                    self._cursor.execute("BEGIN IMMEDIATE")
+            self._cursor.execute(query.replace('%s', '?'), params)
+        except sqlite3.Error as e:
+            raise _translate_error(e) from e
+
+    def executemany(self, query, seq_params):
+        try:
+            self._cursor.executemany(query.replace('%s', '?'), seq_params)
+        except sqlite3.Error as e:
+            raise _translate_error(e) from e
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchmany(self, size=1):
+        return [self._row(row) for row in self._cursor.fetchmany(size)]
+
+    def fetchall(self):
+        return [self._row(row) for row in self._cursor.fetchall()]
+
+    def __iter__(self):
+        for row in self._cursor:
+            yield self._row(row)
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    """Pooled sqlite3 connection exposing the subset of the MySQL API the models use"""
+
+    def __init__(self, backend, connection):
+        self._backend = backend
+        self._connection = connection
+
+    def cursor(self, dictionary=False, buffered=None):
+        return SQLiteCursor(self._connection.cursor(), dictionary=dictionary)
+
+    @property
+    def in_transaction(self):
+        return self._connection.in_transaction
+
+    def commit(self):
+        try:
+            self._connection.commit()
+        except sqlite3.Error as e:
+            raise _translate_error(e) from e
+
+    def rollback(self):
+        self._connection.rollback()
+
+    def close(self):
+        if self._connection is None:
+            return
+        connection, self._connection = self._connection, None
+        self._backend._release(connection)
+
+    def discard(self):
+        if self._connection is None:
+            return
+        connection, self._connection = self._connection, None
+        self._backend._discard(connection)
+
+
+class SQLiteBackend:
+    """Embedded SQLite storage, on a file or ``:memory:``.
+
+    Runs the same SQL as MySQL for fast in-process tests and benchmarks. An
+    in-memory database lives in a single connection, so its pool holds one
+    connection and callers take turns.
+    """
+    name = 'sqlite'
+
+    def __init__(self, path=':memory:', pool_size=5, pool_timeout=10.0):
+        self.path = path
+        self.pool_size = 1 if path == ':memory:' else pool_size
+        self.pool_timeout = pool_timeout
+        self._slots = threading.BoundedSemaphore(self.pool_size)
+        self._lock = threading.Lock()
+        self._idle = []
+        self._in_use = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._timeouts = 0
+        self.create_schema()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            path=os.getenv('DB_PATH', ':memory:'),
+            pool_size=int(os.getenv('DB_POOL_SIZE', 5)),
+            pool_timeout=float(os.getenv('DB_POOL_TIMEOUT', 10))
+        )
+
+    def _connect(self):
+        connection = sqlite3.connect(
+            self.path,
+            timeout=self.pool_timeout,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False
+        )
+        connection.execute("PRAGMA foreign_keys = ON")
+        if self.path != ':memory:':
+            connection.execute("PRAGMA journal_mode = WAL")
+        return connection
+
+    def create_schema(self):
+        with open(SQLITE_SCHEMA) as f:
+            script = f.read()
+        connection = self.checkout()
+        try:
+            connection._connection.executescript(script)
+        finally:
+            connection.close()
+
+    def checkout(self):
+        if not self._slots.acquire(blocking=False):
+            started = time.monotonic()
+            acquired = self._slots.acquire(timeout=self.pool_timeout)
+            with self._lock:
+                self._waits += 1
+                self._wait_time += time.monotonic() - started
+                if not acquired:
+                    self._timeouts += 1
+            if not acquired:
+                raise errors.PoolError(f"Timed out after {self.pool_timeout}s waiting for a database connection")
+        try:
+            with self._lock:
+                connection = self._idle.pop() if self._idle else None
+            if connection is None:
+                connection = self._connect()
+        except sqlite3.Error as e:
+            self._slots.release()
+            raise _translate_error(e) from e
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+        return SQLiteConnection(self, connection)
+
+    def _release(self, connection):
+        if connection.in_transaction:
+            connection.rollback()
+        with self._lock:
+            self._idle.append(connection)
+            self._in_use -= 1
+        self._slots.release()
+
+    def _discard(self, connection):
+        # Closing finalizes any unread statement; an in-memory database would be lost with it
+        if self.path == ':memory:':
+            self._release(connection)
+            return
+        connection.close()
+        with self._lock:
+            self._in_use -= 1
+        self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self.pool_size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'wait_time': round(self._wait_time, 6),
+                'timeouts': self._timeouts,
+                'recycled': 0,
+                'errors': 0,
+            }
+
+
+# Decimal amounts bind as their exact text, not a rounded float, and every
+# DECIMAL column (all scale 2) reads back as a Decimal, as from MySQL
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_converter('DECIMAL', lambda value: Decimal(value.decode()).quantize(CENT))
+
+
+def backend_from_env():
+    """Backend selected by DB_BACKEND ('mysql' or 'sqlite')"""
+    if os.getenv('DB_BACKEND', 'mysql') == 'sqlite':
+        return SQLiteBackend.from_env()
+    return MySQLBackend.from_env()
+
+
+def replica_from_env():
+    """Read-replica backend when DB_REPLICA_HOST is set, else None"""
+    host = os.getenv('DB_REPLICA_HOST')
+    if not host or os.getenv('DB_BACKEND', 'mysql') != 'mysql':
+        return None
+    return MySQLBackend.from_env(host=host, pool_name='banking_replica_pool')
@@ -23,6 +23,21 @@ CREATE TABLE branches (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Bumped by triggers whenever a reference table changes (reference_data.ReferenceData)
+CREATE TABLE reference_versions (
+    name VARCHAR(32) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO reference_versions (name, version) VALUES ('branches', 0);
+
+CREATE TRIGGER branches_version_insert AFTER INSERT ON branches FOR EACH ROW
+    UPDATE reference_versions SET version = version + 1 WHERE name = 'branches';
+CREATE TRIGGER branches_version_update AFTER UPDATE ON branches FOR EACH ROW
+    UPDATE reference_versions SET version = version + 1 WHERE name = 'branches';
+CREATE TRIGGER branches_version_delete AFTER DELETE ON branches FOR EACH ROW
+    UPDATE reference_versions SET version = version + 1 WHERE name = 'branches';
+
 -- Accounts table
 CREATE TABLE accounts (
     account_id INT AUTO_INCREMENT PRIMARY KEY,
@@ -34,10 +49,25 @@ CREATE TABLE accounts (
     balance DECIMAL(15,2) DEFAULT 0.00,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     status ENUM('active', 'inactive', 'suspended') DEFAULT 'active',
+    version BIGINT NOT NULL DEFAULT 0,
+    accrued_interest_micro BIGINT NOT NULL DEFAULT 0,
+    last_accrual_date DATE NULL,
     FOREIGN KEY (user_id) REFERENCES users(user_id),
     FOREIGN KEY (branch_id) REFERENCES branches(branch_id)
 );
 
+-- Every change to an account row moves its version (used for API ETags)
+CREATE TRIGGER accounts_version_bump BEFORE UPDATE ON accounts FOR EACH ROW
+    SET NEW.version = OLD.version + 1;
+
+-- Next account number body; BankAccount reserves blocks of it per process
+CREATE TABLE account_number_sequence (
+    name VARCHAR(32) PRIMARY KEY,
+    next_value BIGINT NOT NULL
+);
+
+INSERT INTO account_number_sequence (name, next_value) VALUES ('accounts', 100000000000);
+
 -- Transactions table
 CREATE TABLE transactions (
     transaction_id INT AUTO_INCREMENT PRIMARY KEY,
@@ -47,10 +77,67 @@ CREATE TABLE transactions (
     transaction_type ENUM('deposit', 'withdrawal', 'transfer', 'interest') NOT NULL,
     description TEXT,
     transaction_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- One index per side of the history query (Transaction.get_transactions)
+    INDEX idx_transactions_from_date (from_account_id, transaction_date, transaction_id),
+    INDEX idx_transactions_to_date (to_account_id, transaction_date, transaction_id),
+    INDEX idx_transactions_date (transaction_date),
     FOREIGN KEY (from_account_id) REFERENCES accounts(account_id),
     FOREIGN KEY (to_account_id) REFERENCES accounts(account_id)
 );
 
+-- Email notifications written in the same transaction as the ledger change
+-- and sent by notification_dispatcher.py
+CREATE TABLE notification_outbox (
+    notification_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    account_id INT NOT NULL,
+    sender_account_id INT,
+    transaction_type VARCHAR(20) NOT NULL,
+    amount DECIMAL(15,2) NOT NULL,
+    description TEXT,
+    user_email VARCHAR(100) NOT NULL,
+    user_name VARCHAR(100) NOT NULL,
+    account_number VARCHAR(20) NOT NULL,
+    balance DECIMAL(15,2) NOT NULL,
+    status ENUM('pending', 'sending', 'sent', 'dead') NOT NULL DEFAULT 'pending',
+    attempts INT NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    sent_at TIMESTAMP NULL,
+    INDEX idx_outbox_due (status, next_attempt_at),
+    FOREIGN KEY (account_id) REFERENCES accounts(account_id)
+);
+
+-- Closing balance per account for each day it had activity (balance_snapshots.py)
+CREATE TABLE account_daily_balances (
+    account_id INT NOT NULL,
+    balance_date DATE NOT NULL,
+    closing_balance DECIMAL(15,2) NOT NULL,
+    PRIMARY KEY (account_id, balance_date),
+    INDEX idx_daily_balances_date (balance_date),
+    FOREIGN KEY (account_id) REFERENCES accounts(account_id)
+);
+
+-- Days the snapshot job has completed
+CREATE TABLE account_daily_balance_runs (
+    balance_date DATE PRIMARY KEY,
+    accounts INT NOT NULL,
+    finished_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Idempotency keys for retried money movement (idempotency.py);
+-- response is NULL while the request is in flight
+CREATE TABLE idempotency_keys (
+    user_id INT NOT NULL,
+    idempotency_key VARCHAR(255) NOT NULL,
+    request_hash CHAR(24) NOT NULL,
+    response MEDIUMTEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, idempotency_key),
+    INDEX idx_idempotency_keys_created (created_at),
+    FOREIGN KEY (user_id) REFERENCES users(user_id)
+);
+
 -- Beneficiaries table for quick transfers
 CREATE TABLE beneficiaries (
     beneficiary_id INT AUTO_INCREMENT PRIMARY KEY,
@@ -63,3 +150,68 @@ CREATE TABLE beneficiaries (
 );
 
 
+
+
+-- Server-side transfer used when TRANSFER_USE_PROCEDURE=1 (see Transaction._transfer_procedure).
+-- Both balance updates are conditional single statements applied in account_id order,
+-- and the whole transfer, including its outbox notifications, commits inside one CALL.
+DELIMITER //
+CREATE PROCEDURE transfer_funds(
+    IN p_from_account_id INT,
+    IN p_to_account_number VARCHAR(20),
+    IN p_amount DECIMAL(15,2),
+    IN p_description TEXT,
+    OUT p_status VARCHAR(32)
+)
+BEGIN
+    DECLARE v_to_account_id INT DEFAULT NULL;
+    DECLARE EXIT HANDLER FOR SQLEXCEPTION
+    BEGIN
+        ROLLBACK;
+        RESIGNAL;
+    END;
+
+    SET p_status = 'ok';
+    SELECT account_id INTO v_to_account_id FROM accounts WHERE account_number = p_to_account_number;
+
+    IF v_to_account_id IS NULL THEN
+        SET p_status = 'receiver_not_found';
+    ELSE
+        START TRANSACTION;
+        IF v_to_account_id < p_from_account_id THEN
+            UPDATE accounts SET balance = balance + p_amount WHERE account_id = v_to_account_id;
+        END IF;
+
+        UPDATE accounts SET balance = balance - p_amount
+        WHERE account_id = p_from_account_id AND balance >= p_amount;
+
+        IF ROW_COUNT() = 0 THEN
+            ROLLBACK;
+            IF EXISTS (SELECT 1 FROM accounts WHERE account_id = p_from_account_id) THEN
+                SET p_status = 'insufficient_balance';
+            ELSE
+                SET p_status = 'sender_not_found';
+            END IF;
+        ELSE
+            IF v_to_account_id >= p_from_account_id THEN
+                UPDATE accounts SET balance = balance + p_amount WHERE account_id = v_to_account_id;
+            END IF;
+            INSERT INTO transactions (from_account_id, to_account_id, amount, transaction_type, description)
+            VALUES (p_from_account_id, v_to_account_id, p_amount, 'transfer', p_description);
+
+            INSERT INTO notification_outbox
+                (account_id, sender_account_id, transaction_type, amount, description,
+                 user_email, user_name, account_number, balance)
+            SELECT a.account_id,
+                   IF(n.kind = 'deposit', p_from_account_id, NULL),
+                   n.kind, p_amount, p_description, u.email, u.full_name, a.account_number, a.balance
+            FROM (SELECT p_from_account_id AS account_id, 'transfer' AS kind
+                  UNION ALL
+                  SELECT v_to_account_id, 'deposit') AS n
+            JOIN accounts a ON a.account_id = n.account_id
+            JOIN users u ON u.user_id = a.user_id;
+            COMMIT;
+        END IF;
+    END IF;
+END //
+DELIMITER ;
@@ -0,0 +1,154 @@
+-- SQLite version of tables.sql for the embedded storage backend
+-- (see storage.SQLiteBackend). Keep in sync with tables.sql.
+
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username VARCHAR(50) UNIQUE NOT NULL,
+    password_hash VARCHAR(255) NOT NULL,
+    email VARCHAR(100) UNIQUE NOT NULL,
+    full_name VARCHAR(100) NOT NULL,
+    phone VARCHAR(15),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS branches (
+    branch_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    branch_name VARCHAR(100) NOT NULL,
+    branch_code VARCHAR(10) UNIQUE NOT NULL,
+    address TEXT,
+    phone VARCHAR(15),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS reference_versions (
+    name VARCHAR(32) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT OR IGNORE INTO reference_versions (name, version) VALUES ('branches', 0);
+
+CREATE TRIGGER IF NOT EXISTS branches_version_insert AFTER INSERT ON branches FOR EACH ROW
+BEGIN
+    UPDATE reference_versions SET version = version + 1 WHERE name = 'branches';
+END;
+CREATE TRIGGER IF NOT EXISTS branches_version_update AFTER UPDATE ON branches FOR EACH ROW
+BEGIN
+    UPDATE reference_versions SET version = version + 1 WHERE name = 'branches';
+END;
+CREATE TRIGGER IF NOT EXISTS branches_version_delete AFTER DELETE ON branches FOR EACH ROW
+BEGIN
+    UPDATE reference_versions SET version = version + 1 WHERE name = 'branches';
+END;
+
+CREATE TABLE IF NOT EXISTS accounts (
+    account_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INT,
+    branch_id INT,
+    account_number VARCHAR(20) UNIQUE NOT NULL,
+    account_type TEXT NOT NULL CHECK (account_type IN ('savings', 'current')),
+    interest DECIMAL(3,2) DEFAULT 0.00,
+    balance DECIMAL(15,2) DEFAULT 0.00,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    status TEXT DEFAULT 'active' CHECK (status IN ('active', 'inactive', 'suspended')),
+    version BIGINT NOT NULL DEFAULT 0,
+    accrued_interest_micro BIGINT NOT NULL DEFAULT 0,
+    last_accrual_date DATE NULL,
+    FOREIGN KEY (user_id) REFERENCES users(user_id),
+    FOREIGN KEY (branch_id) REFERENCES branches(branch_id)
+);
+
+-- Any update bumps the version, as in MySQL. SQLite stores DECIMAL as REAL,
+-- so the balance is also rounded back to cents, as DECIMAL(15,2) would be,
+-- before float error can build up. SQLite cannot assign NEW in a trigger;
+-- the nested UPDATE does not fire it again. Dropped first so files created
+-- with an older definition pick this one up.
+DROP TRIGGER IF EXISTS accounts_version_bump;
+CREATE TRIGGER accounts_version_bump AFTER UPDATE ON accounts FOR EACH ROW
+BEGIN
+    UPDATE accounts SET version = OLD.version + 1, balance = ROUND(NEW.balance, 2)
+    WHERE account_id = NEW.account_id;
+END;
+
+CREATE TABLE IF NOT EXISTS account_number_sequence (
+    name VARCHAR(32) PRIMARY KEY,
+    next_value BIGINT NOT NULL
+);
+
+INSERT OR IGNORE INTO account_number_sequence (name, next_value) VALUES ('accounts', 100000000000);
+
+CREATE TABLE IF NOT EXISTS transactions (
+    transaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    from_account_id INT,
+    to_account_id INT,
+    amount DECIMAL(15,2) NOT NULL,
+    transaction_type TEXT NOT NULL CHECK (transaction_type IN ('deposit', 'withdrawal', 'transfer', 'interest')),
+    description TEXT,
+    transaction_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (from_account_id) REFERENCES accounts(account_id),
+    FOREIGN KEY (to_account_id) REFERENCES accounts(account_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_transactions_from_date ON transactions (from_account_id, transaction_date, transaction_id);
+CREATE INDEX IF NOT EXISTS idx_transactions_to_date ON transactions (to_account_id, transaction_date, transaction_id);
+CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions (transaction_date);
+
+CREATE TABLE IF NOT EXISTS notification_outbox (
+    notification_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    account_id INT NOT NULL,
+    sender_account_id INT,
+    transaction_type VARCHAR(20) NOT NULL,
+    amount DECIMAL(15,2) NOT NULL,
+    description TEXT,
+    user_email VARCHAR(100) NOT NULL,
+    user_name VARCHAR(100) NOT NULL,
+    account_number VARCHAR(20) NOT NULL,
+    balance DECIMAL(15,2) NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'sending', 'sent', 'dead')),
+    attempts INT NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    sent_at TIMESTAMP NULL,
+    FOREIGN KEY (account_id) REFERENCES accounts(account_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_outbox_due ON notification_outbox (status, next_attempt_at);
+
+CREATE TABLE IF NOT EXISTS account_daily_balances (
+    account_id INT NOT NULL,
+    balance_date DATE NOT NULL,
+    closing_balance DECIMAL(15,2) NOT NULL,
+    PRIMARY KEY (account_id, balance_date),
+    FOREIGN KEY (account_id) REFERENCES accounts(account_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_daily_balances_date ON account_daily_balances (balance_date);
+
+CREATE TABLE IF NOT EXISTS account_daily_balance_runs (
+    balance_date DATE PRIMARY KEY,
+    accounts INT NOT NULL,
+    finished_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Idempotency keys for retried money movement (idempotency.py)
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    user_id INT NOT NULL,
+    idempotency_key VARCHAR(255) NOT NULL,
+    request_hash CHAR(24) NOT NULL,
+    response TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, idempotency_key),
+    FOREIGN KEY (user_id) REFERENCES users(user_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys (created_at);
+
+CREATE TABLE IF NOT EXISTS beneficiaries (
+    beneficiary_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    account_id INT,
+    beneficiary_account_number VARCHAR(20) NOT NULL,
+    beneficiary_name VARCHAR(100) NOT NULL,
+    nickname VARCHAR(50),
+    added_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (account_id) REFERENCES accounts(account_id)
+);
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Ledger tests against the embedded SQLite backend.
+
+    python -m pytest -q test_ledger.py
+"""
+
+import threading
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+from mysql.connector import Error
+
+from idempotency import IdempotencyConflict, IdempotencyStore
+from model import Database, BankAccount, Transaction
+from storage import ER_LOCK_DEADLOCK, SQLiteBackend
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(SQLiteBackend(str(tmp_path / 'bank.db')))
+    connection = db.checkout()
+    cursor = connection.cursor()
+    cursor.execute("INSERT INTO branches (branch_name, branch_code) VALUES ('Main', 'MAIN')")
+    cursor.execute("""
+        INSERT INTO users (username, password_hash, email, full_name, phone)
+        VALUES ('alice', 'x', 'alice@example.com', 'Alice', '1')
+    """)
+    connection.commit()
+    cursor.close()
+    connection.close()
+    return db
+
+
+@pytest.fixture
+def transactions(db):
+    transaction_model = Transaction(db, max_retries=3)
+    transaction_model.retry_backoff = 0
+    return transaction_model
+
+
+def open_account(db, opening_balance=0):
+    account_number = BankAccount(db).create_account(1, 1, 'current')
+    account_id = db.account_directory.resolve(account_number)['account_id']
+    if opening_balance:
+        assert Transaction(db).deposit(account_id, Decimal(opening_balance))[0]
+    return account_id, account_number
+
+
+def balance(db, account_id):
+    connection = db.checkout()
+    cursor = connection.cursor(dictionary=True)
+    cursor.execute("SELECT balance FROM accounts WHERE account_id = %s", (account_id,))
+    row = cursor.fetchone()
+    cursor.close()
+    connection.close()
+    return row['balance']
+
+
+def transaction_count(db):
+    connection = db.checkout()
+    cursor = connection.cursor()
+    cursor.execute("SELECT COUNT(*) FROM transactions")
+    count = cursor.fetchone()[0]
+    cursor.close()
+    connection.close()
+    return count
+
+
+def test_balances_read_back_as_exact_decimals(db, transactions):
+    account_id, _ = open_account(db)
+    for _ in range(10):
+        assert transactions.deposit(account_id, Decimal('0.10'))[0]
+    assert balance(db, account_id) == Decimal('1.00')
+    assert transactions.withdraw(account_id, Decimal('1.00')) == (True, "Withdrawal successful")
+
+
+def test_withdraw_cannot_overdraw(db, transactions):
+    account_id, _ = open_account(db, 100)
+    count = transaction_count(db)
+
+    assert transactions.withdraw(account_id, Decimal('100.01')) == (False, "Insufficient balance")
+    assert balance(db, account_id) == Decimal('100.00')
+    assert transaction_count(db) == count
+
+
+def test_transfer_cannot_overdraw(db, transactions):
+    sender, _ = open_account(db, 50)
+    receiver, receiver_number = open_account(db)
+
+    assert transactions.transfer(sender, receiver_number, Decimal('50.01')) == (False, "Insufficient balance")
+    assert balance(db, sender) == Decimal('50.00')
+    assert balance(db, receiver) == Decimal('0.00')
+
+
+def test_concurrent_withdrawals_debit_at_most_the_balance(db, transactions):
+    account_id, _ = open_account(db, 100)
+    results = []
+
+    def withdraw():
+        results.append(transactions.withdraw(account_id, Decimal('30')))
+
+    threads = [threading.Thread(target=withdraw) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(1 for success, _ in results if success) == 3
+    assert balance(db, account_id) == Decimal('10.00')
+
+
+def test_deadlock_victim_is_retried(transactions):
+    attempts = []
+
+    def work(cursor):
+        attempts.append(cursor)
+        if len(attempts) == 1:
+            raise Error(msg="Deadlock found when trying to get lock", errno=ER_LOCK_DEADLOCK)
+        return True, "done"
+
+    assert transactions._run_with_retry(work, 'test') == (True, "done")
+    assert len(attempts) == 2
+    assert transactions.lock_stats()['deadlocks'] == 1
+    assert transactions.lock_stats()['retries'] == 1
+
+
+def test_deadlock_retries_are_bounded(transactions):
+    def work(cursor):
+        raise Error(msg="Deadlock found when trying to get lock", errno=ER_LOCK_DEADLOCK)
+
+    success, _ = transactions._run_with_retry(work, 'test')
+    assert not success
+    assert transactions.lock_stats()['retries'] == transactions.max_retries
+    assert transactions.lock_stats()['retries_exhausted'] == 1
+
+
+def test_atomic_batch_with_a_bad_transfer_posts_nothing(db, transactions):
+    sender, _ = open_account(db, 100)
+    receiver, receiver_number = open_account(db)
+    count = transaction_count(db)
+
+    results = transactions.transfer_batch([
+        {'from_account_id': sender, 'to_account_number': receiver_number, 'amount': Decimal('10')},
+        {'from_account_id': sender, 'to_account_number': receiver_number, 'amount': Decimal('500')},
+    ])
+
+    assert [success for success, _ in results] == [False, False]
+    assert results[1] == (False, "Insufficient balance")
+    assert balance(db, sender) == Decimal('100.00')
+    assert balance(db, receiver) == Decimal('0.00')
+    assert transaction_count(db) == count
+
+
+def test_non_atomic_batch_posts_the_good_transfers(db, transactions):
+    sender, _ = open_account(db, 100)
+    receiver, receiver_number = open_account(db)
+
+    results = transactions.transfer_batch([
+        {'from_account_id': sender, 'to_account_number': receiver_number, 'amount': Decimal('10')},
+        {'from_account_id': sender, 'to_account_number': '0000000000', 'amount': Decimal('10')},
+    ], atomic=False)
+
+    assert results[0] == (True, "Transfer successful")
+    assert not results[1][0]
+    assert balance(db, sender) == Decimal('90.00')
+    assert balance(db, receiver) == Decimal('10.00')
+
+
+def test_idempotent_retry_replays_without_posting_again(db, transactions):
+    account_id, _ = open_account(db)
+    store = IdempotencyStore(db)
+    fingerprint = store.fingerprint('deposit', account_id, '25')
+
+    def deposit():
+        success, message = transactions.deposit(account_id, Decimal('25'))
+        return success, {'message': message}
+
+    assert store.run(1, 'key-1', fingerprint, deposit) == (True, {'message': "Deposit successful"}, False)
+    assert store.run(1, 'key-1', fingerprint, deposit) == (True, {'message': "Deposit successful"}, True)
+    store.cache.clear()
+    assert store.run(1, 'key-1', fingerprint, deposit) == (True, {'message': "Deposit successful"}, True)
+    assert balance(db, account_id) == Decimal('25.00')
+
+    with pytest.raises(IdempotencyConflict):
+        store.run(1, 'key-1', store.fingerprint('deposit', account_id, '30'), deposit)
+
+
+def test_failed_operation_releases_its_idempotency_key(db, transactions):
+    account_id, _ = open_account(db)
+    store = IdempotencyStore(db)
+    fingerprint = store.fingerprint('withdraw', account_id, '5')
+
+    def withdraw():
+        success, message = transactions.withdraw(account_id, Decimal('5'))
+        return success, {'message': message}
+
+    assert store.run(1, 'key-2', fingerprint, withdraw)[:2] == (False, {'message': "Insufficient balance"})
+    transactions.deposit(account_id, Decimal('5'))
+    assert store.run(1, 'key-2', fingerprint, withdraw) == (True, {'message': "Withdrawal successful"}, False)
+    assert balance(db, account_id) == Decimal('0.00')
+
+
+def test_abandoned_statement_gives_its_connection_back(db, transactions):
+    account_id, _ = open_account(db)
+    for _ in range(20):
+        transactions.deposit(account_id, Decimal('1'))
+
+    rows = transactions.iter_statement(account_id, datetime(2000, 1, 1), datetime(2100, 1, 1), batch_size=5)
+    assert next(rows)['amount'] == Decimal('1.00')
+    rows.close()
+
+    assert db.backend.stats()['in_use'] == 0
+    assert len(list(transactions.iter_statement(account_id, datetime(2000, 1, 1), datetime(2100, 1, 1)))) == 20